@@ -4,27 +4,403 @@ Database Manager - Handles database operations for AI backend
 
 import asyncio
 import logging
-import json
 import os
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Any, Union
+from datetime import datetime, timedelta, timezone
 import asyncpg
+import orjson
+from asyncpg.prepared_stmt import PreparedStatement
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 
 from utils.logger import setup_logger
+from utils.batch_writer import BatchWriter
+from utils.cache import TTLCache
 
 logger = setup_logger(__name__)
 
+# Pool sizing follows the host so bursts don't queue on a handful of connections
+_CPU_COUNT = os.cpu_count() or 1
+POOL_MIN_SIZE = int(os.getenv("AI_DB_POOL_MIN", str(max(10, _CPU_COUNT * 2))))
+POOL_MAX_SIZE = int(os.getenv("AI_DB_POOL_MAX", str(max(40, _CPU_COUNT * 4))))
+POOL_MAX_QUERIES = int(os.getenv("AI_DB_POOL_MAX_QUERIES", "50000"))
+COMMAND_TIMEOUT = float(os.getenv("AI_DB_COMMAND_TIMEOUT", "5"))
+
+# Set when connecting through PgBouncer in transaction-pooling mode: server-side
+# prepared statements and LISTEN don't survive backends being swapped per transaction
+USE_PGBOUNCER = os.getenv("AI_DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+# Optional streaming replica for report/list reads; unset sends them to the primary
+REPLICA_HOST = os.getenv("AI_DB_HOST_REPLICA")
+
+# Rule usage events are buffered briefly and written with a single INSERT per batch
+RULE_USAGE_FLUSH_INTERVAL = float(os.getenv("AI_DB_RULE_USAGE_FLUSH_MS", "50")) / 1000
+
+# rule_sets.usage_count is a hot row: increments are summed per rule set and
+# applied with one UPDATE per window instead of one per event
+RULE_USAGE_COUNT_FLUSH_INTERVAL = float(os.getenv("AI_DB_RULE_USAGE_COUNT_FLUSH_MS", "1000")) / 1000
+RULE_USAGE_COUNT_BATCH_SIZE = 10000
+
+# token_usage is range-partitioned by month; keep this many future months ready
+USAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("AI_DB_USAGE_PARTITION_MONTHS_AHEAD", "1"))
+USAGE_PARTITION_CHECK_INTERVAL = 24 * 60 * 60
+
+# Rule sets and model configs are read on every request but rarely change;
+# writes invalidate locally and rule set changes are broadcast via NOTIFY
+CONFIG_CACHE_TTL = float(os.getenv("AI_DB_CONFIG_CACHE_TTL", "60"))
+CONFIG_CACHE_SIZE = int(os.getenv("AI_DB_CONFIG_CACHE_SIZE", "1024"))
+RULE_SET_CHANGED_CHANNEL = "rule_set_changed"
+
+# get_status is polled by health checks; concurrent callers share one result
+STATUS_CACHE_TTL = float(os.getenv("AI_DB_STATUS_CACHE_TTL", "5"))
+
+# Liveness comes from a background ping rather than a query per probe
+PING_INTERVAL = 30
+PING_STALE_AFTER = 60
+
+USAGE_COLUMNS = (
+    "model_id", "user_id", "request_id", "input_tokens", "output_tokens",
+    "total_tokens", "estimated_cost", "currency", "context", "timestamp"
+)
+
+RULE_USAGE_COLUMNS = ("rule_set_id", "rules_applied", "phase", "timestamp")
+
+# SQL lives in module-level constants with whitespace collapsed, so every
+# call sends the same compact text and pg_stat_statements groups it cleanly
+
+# Token usage
+_SQL_USAGE_IS_PARTITIONED = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'token_usage'::regclass"
+
+_SQL_CREATE_USAGE_DEFAULT_PARTITION = "CREATE TABLE IF NOT EXISTS token_usage_default PARTITION OF token_usage DEFAULT"
+
+_SQL_SYNC_COMMIT_OFF = "SET LOCAL synchronous_commit TO OFF"
+
+_SQL_GET_USER_USAGE = (
+    "SELECT model_id, user_id, input_tokens, output_tokens, total_tokens, "
+    "estimated_cost, currency, timestamp "
+    "FROM token_usage "
+    "WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "ORDER BY timestamp DESC"
+)
+
+_SQL_GET_USER_USAGE_WITH_CONTEXT = (
+    "SELECT id, model_id, user_id, request_id, input_tokens, output_tokens, "
+    "total_tokens, estimated_cost, currency, context, timestamp, created_at "
+    "FROM token_usage "
+    "WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "ORDER BY timestamp DESC"
+)
+
+_SQL_GET_MODEL_USAGE = (
+    "SELECT model_id, user_id, input_tokens, output_tokens, total_tokens, "
+    "estimated_cost, currency, timestamp "
+    "FROM token_usage "
+    "WHERE model_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "ORDER BY timestamp DESC"
+)
+
+_SQL_GET_USER_USAGE_SUMMARY = (
+    "SELECT date_trunc('hour', timestamp) AS bucket, "
+    "COUNT(*) AS requests, "
+    "SUM(input_tokens) AS input_tokens, "
+    "SUM(output_tokens) AS output_tokens, "
+    "SUM(total_tokens) AS total_tokens, "
+    "SUM(estimated_cost) AS estimated_cost "
+    "FROM token_usage "
+    "WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "GROUP BY 1 "
+    "ORDER BY 1"
+)
+
+_SQL_GET_USER_USAGE_BY_MODEL = (
+    "SELECT model_id, "
+    "COUNT(*) AS requests, "
+    "SUM(input_tokens) AS input_tokens, "
+    "SUM(output_tokens) AS output_tokens, "
+    "SUM(total_tokens) AS total_tokens, "
+    "SUM(estimated_cost) AS estimated_cost, "
+    "MAX(currency) AS currency "
+    "FROM token_usage "
+    "WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "GROUP BY model_id"
+)
+
+_SQL_GET_USER_USAGE_BY_DAY = (
+    "SELECT (timestamp AT TIME ZONE 'UTC')::date AS day, "
+    "COUNT(*) AS requests, "
+    "SUM(total_tokens) AS total_tokens, "
+    "SUM(estimated_cost) AS estimated_cost "
+    "FROM token_usage "
+    "WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "GROUP BY 1 "
+    "ORDER BY 1 DESC"
+)
+
+_SQL_GET_TOTAL_USAGE_BY_MODEL = (
+    "SELECT model_id, "
+    "COUNT(*) AS requests, "
+    "SUM(input_tokens) AS input_tokens, "
+    "SUM(output_tokens) AS output_tokens, "
+    "SUM(total_tokens) AS total_tokens, "
+    "SUM(estimated_cost) AS estimated_cost, "
+    "MAX(currency) AS currency "
+    "FROM token_usage "
+    "WHERE timestamp >= $1 AND timestamp <= $2 "
+    "GROUP BY model_id"
+)
+
+_SQL_GET_TOTAL_USAGE_BY_DAY = (
+    "SELECT (timestamp AT TIME ZONE 'UTC')::date AS day, "
+    "COUNT(*) AS requests, "
+    "SUM(total_tokens) AS total_tokens, "
+    "SUM(estimated_cost) AS estimated_cost "
+    "FROM token_usage "
+    "WHERE timestamp >= $1 AND timestamp <= $2 "
+    "GROUP BY 1 "
+    "ORDER BY 1 DESC"
+)
+
+_SQL_GET_TOP_USERS = (
+    "SELECT user_id, "
+    "COUNT(*) AS requests, "
+    "SUM(total_tokens) AS tokens, "
+    "SUM(estimated_cost) AS cost "
+    "FROM token_usage "
+    "WHERE timestamp >= $1 AND timestamp <= $2 "
+    "GROUP BY user_id "
+    "ORDER BY SUM(estimated_cost) DESC "
+    "LIMIT $3"
+)
+
+_SQL_GET_MODEL_USAGE_TOTALS = (
+    "SELECT COUNT(*) AS requests, "
+    "COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+    "COALESCE(SUM(output_tokens), 0) AS output_tokens, "
+    "COALESCE(SUM(total_tokens), 0) AS total_tokens, "
+    "COALESCE(SUM(estimated_cost), 0) AS estimated_cost "
+    "FROM token_usage "
+    "WHERE model_id = $1 AND timestamp >= $2 AND timestamp <= $3"
+)
+
+_SQL_GET_MODEL_TOP_USERS = (
+    "SELECT user_id, "
+    "COUNT(*) AS requests, "
+    "SUM(estimated_cost) AS cost "
+    "FROM token_usage "
+    "WHERE model_id = $1 AND timestamp >= $2 AND timestamp <= $3 "
+    "GROUP BY user_id "
+    "ORDER BY SUM(estimated_cost) DESC "
+    "LIMIT $4"
+)
+
+# Rule sets
+_SQL_GET_RULE_SET = (
+    "SELECT rule_set_id, name, description, rules, is_active, applies_to_models, "
+    "created_by, created_at, updated_at, usage_count, last_used "
+    "FROM rule_sets WHERE rule_set_id = $1"
+)
+
+_SQL_INSERT_RULE_SET = (
+    "INSERT INTO rule_sets ( "
+    "rule_set_id, name, description, rules, is_active, "
+    "applies_to_models, created_by, created_at, updated_at "
+    ") VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)"
+)
+
+_SQL_LIST_RULE_SETS_FOR_USER = (
+    "SELECT rule_set_id, name, description, rules, is_active, applies_to_models, "
+    "created_by, created_at, updated_at, usage_count, last_used "
+    "FROM rule_sets "
+    "WHERE created_by = $1 OR created_by IS NULL "
+    "ORDER BY created_at DESC"
+)
+
+_SQL_LIST_RULE_SETS = (
+    "SELECT rule_set_id, name, description, rules, is_active, applies_to_models, "
+    "created_by, created_at, updated_at, usage_count, last_used "
+    "FROM rule_sets ORDER BY created_at DESC"
+)
+
+_SQL_UPDATE_RULE_SET = (
+    "UPDATE rule_sets SET "
+    "name = $2, "
+    "description = $3, "
+    "rules = $4, "
+    "is_active = $5, "
+    "applies_to_models = $6, "
+    "updated_at = $7 "
+    "WHERE rule_set_id = $1"
+)
+
+_SQL_DELETE_RULE_SET = "DELETE FROM rule_sets WHERE rule_set_id = $1"
+
+# Events for rule sets deleted while queued are dropped by the join instead of
+# failing the FK check for the whole batch
+_SQL_INSERT_RULE_USAGE_BULK = (
+    "INSERT INTO rule_usage (rule_set_id, rules_applied, phase, timestamp) "
+    "SELECT u.rule_set_id, u.rules_applied, u.phase, u.ts "
+    "FROM UNNEST($1::varchar[], $2::jsonb[], $3::varchar[], $4::timestamptz[]) "
+    "AS u(rule_set_id, rules_applied, phase, ts) "
+    "JOIN rule_sets r ON r.rule_set_id = u.rule_set_id "
+    "FOR KEY SHARE OF r "
+    "RETURNING rule_set_id, timestamp"
+)
+
+_SQL_INCREMENT_RULE_USAGE = (
+    "UPDATE rule_sets SET "
+    "usage_count = usage_count + u.delta, "
+    "last_used = GREATEST(last_used, u.ts) "
+    "FROM UNNEST($1::varchar[], $2::int[], $3::timestamptz[]) AS u(rule_set_id, delta, ts) "
+    "WHERE rule_sets.rule_set_id = u.rule_set_id"
+)
+
+_SQL_COUNT_RULE_SETS = "SELECT total FROM rule_sets_stats"
+
+_SQL_COUNT_ACTIVE_RULE_SETS = "SELECT active FROM rule_sets_stats"
+
+# Model configs
+_SQL_GET_MODEL_CONFIG = (
+    "SELECT model_id, model_type, name, description, config, pricing, is_active, "
+    "health_status, last_health_check, created_at, updated_at "
+    "FROM model_configs WHERE model_id = $1"
+)
+
+_SQL_SAVE_MODEL_CONFIG = (
+    "INSERT INTO model_configs ( "
+    "model_id, model_type, name, description, config, pricing, "
+    "is_active, health_status, last_health_check "
+    ") VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) "
+    "ON CONFLICT (model_id) DO UPDATE SET "
+    "model_type = $2, "
+    "name = $3, "
+    "description = $4, "
+    "config = $5, "
+    "pricing = $6, "
+    "is_active = $7, "
+    "health_status = $8, "
+    "last_health_check = $9, "
+    "updated_at = NOW()"
+)
+
+_SQL_SAVE_MODEL_CONFIGS_BULK = (
+    "INSERT INTO model_configs ( "
+    "model_id, model_type, name, description, config, pricing, "
+    "is_active, health_status, last_health_check "
+    ") "
+    "SELECT * "
+    "FROM UNNEST( "
+    "$1::varchar[], $2::varchar[], $3::varchar[], $4::text[], "
+    "$5::jsonb[], $6::jsonb[], $7::boolean[], $8::varchar[], "
+    "$9::timestamptz[] "
+    ") AS m "
+    "ON CONFLICT (model_id) DO UPDATE SET "
+    "model_type = EXCLUDED.model_type, "
+    "name = EXCLUDED.name, "
+    "description = EXCLUDED.description, "
+    "config = EXCLUDED.config, "
+    "pricing = EXCLUDED.pricing, "
+    "is_active = EXCLUDED.is_active, "
+    "health_status = EXCLUDED.health_status, "
+    "last_health_check = EXCLUDED.last_health_check, "
+    "updated_at = NOW()"
+)
+
+_SQL_COUNT_MODELS = "SELECT COUNT(*) FROM model_configs"
+
+# Status
+_SQL_PING = "SELECT 1"
+
+_SQL_ESTIMATE_USAGE_ROWS = (
+    "SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::BIGINT "
+    "FROM pg_class c "
+    "WHERE c.oid = 'token_usage'::regclass "
+    "OR c.oid IN ( "
+    "SELECT inhrelid FROM pg_inherits "
+    "WHERE inhparent = 'token_usage'::regclass "
+    ")"
+)
+
+_SQL_COUNT_RECENT_USAGE = (
+    "SELECT COUNT(*) FROM token_usage "
+    "WHERE timestamp >= NOW() - INTERVAL '24 hours'"
+)
+
+# Hot-path statements, prepared once per pooled connection on first use
+PREPARED_STATEMENTS = {
+    "get_rule_set": _SQL_GET_RULE_SET,
+    "get_model_config": _SQL_GET_MODEL_CONFIG,
+}
+
+# Connection pinned by DatabaseManager.batch() for the current task
+_batch_connection: ContextVar[Optional[asyncpg.Connection]] = ContextVar(
+    "batch_connection", default=None
+)
+
+class PreparedConnection(asyncpg.Connection):
+    """Pooled connection that keeps its prepared statements alongside it"""
+    
+    statements: Dict[str, PreparedStatement]
+
+class _UnpreparedStatement:
+    """Runs a PREPARED_STATEMENTS query unprepared, for use behind PgBouncer"""
+    
+    def __init__(self, conn: asyncpg.Connection, query: str):
+        self._conn = conn
+        self._query = query
+    
+    async def fetchrow(self, *args):
+        return await self._conn.fetchrow(self._query, *args)
+
+# Binary JSONB wire format is a version byte followed by the JSON text
+JSONB_VERSION = b'\x01'
+
+def _encode_jsonb(value: Any) -> bytes:
+    return JSONB_VERSION + orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+
+def _decode_jsonb(data: bytes) -> Any:
+    return orjson.loads(data[1:])
+
+def _month_start(moment: datetime, offset: int = 0) -> datetime:
+    """First instant (UTC) of the month `offset` months after `moment`"""
+    month_index = moment.month - 1 + offset
+    return datetime(moment.year + month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
 class DatabaseManager:
     """Manages database connections and operations"""
     
     def __init__(self):
         self.pool = None
+        self.ro_pool = None
         self.connection_string = self._build_connection_string()
+        self.replica_connection_string = (
+            self._build_connection_string(REPLICA_HOST) if REPLICA_HOST else None
+        )
+        self._rule_usage_writer = BatchWriter(
+            "rule_usage",
+            self.track_rule_usage_many,
+            flush_interval=RULE_USAGE_FLUSH_INTERVAL
+        )
+        self._rule_usage_count_writer = BatchWriter(
+            "rule_usage_count",
+            self.increment_rule_usage_counts,
+            batch_size=RULE_USAGE_COUNT_BATCH_SIZE,
+            flush_interval=RULE_USAGE_COUNT_FLUSH_INTERVAL
+        )
+        self._partition_task: Optional[asyncio.Task] = None
+        self._rule_set_cache = TTLCache(maxsize=CONFIG_CACHE_SIZE, ttl=CONFIG_CACHE_TTL)
+        self._model_config_cache = TTLCache(maxsize=CONFIG_CACHE_SIZE, ttl=CONFIG_CACHE_TTL)
+        self._listener: Optional[asyncpg.Connection] = None
+        self._rule_set_callbacks: List[Callable[[str], Any]] = []
+        self._status_cache = TTLCache(maxsize=1, ttl=STATUS_CACHE_TTL)
+        self._status_lock = asyncio.Lock()
+        self._ping_task: Optional[asyncio.Task] = None
+        self._last_ok = 0.0
         
-    def _build_connection_string(self) -> str:
+    def _build_connection_string(self, host: Optional[str] = None) -> str:
         """Build PostgreSQL connection string"""
-        host = os.getenv("AI_DB_HOST", "localhost")
+        host = host or os.getenv("AI_DB_HOST", "localhost")
         port = os.getenv("AI_DB_PORT", "5432")
         database = os.getenv("AI_DB_NAME", "ai_backend")
         user = os.getenv("AI_DB_USER", "postgres")
@@ -35,15 +411,32 @@ class DatabaseManager:
     async def initialize(self):
         """Initialize database connection pool"""
         try:
-            self.pool = await asyncpg.create_pool(
-                self.connection_string,
-                min_size=5,
-                max_size=20,
-                command_timeout=60
-            )
+            self.pool = await self._create_pool(self.connection_string, "ai-backend")
+            
+            if self.replica_connection_string:
+                self.ro_pool = await self._create_pool(
+                    self.replica_connection_string,
+                    "ai-backend-ro",
+                    readonly=True
+                )
             
             # Create tables if they don't exist
             await self._create_tables()
+            self._last_ok = time.monotonic()
+            
+            # Start background writers for buffered rule usage events
+            self._rule_usage_writer.start()
+            self._rule_usage_count_writer.start()
+            
+            # Keep upcoming token_usage partitions created ahead of time
+            self._partition_task = asyncio.create_task(self._partition_maintenance_loop())
+            
+            # Verify connectivity in the background for is_connected()
+            self._ping_task = asyncio.create_task(self._periodic_ping())
+            
+            # Drop cached rule sets when another process changes them
+            if not USE_PGBOUNCER:
+                await self._listen_invalidations()
             
             logger.info("Database initialized successfully")
             
@@ -51,14 +444,115 @@ class DatabaseManager:
             logger.error(f"Failed to initialize database: {e}")
             raise
     
+    async def _create_pool(
+        self, 
+        dsn: str, 
+        application_name: str, 
+        readonly: bool = False
+    ) -> asyncpg.Pool:
+        """Create a connection pool with the service's standard settings"""
+        return await asyncpg.create_pool(
+            dsn,
+            min_size=POOL_MIN_SIZE,
+            max_size=POOL_MAX_SIZE,
+            max_queries=POOL_MAX_QUERIES,
+            command_timeout=COMMAND_TIMEOUT,
+            statement_cache_size=0 if USE_PGBOUNCER else 1024,
+            max_inactive_connection_lifetime=300.0,
+            connection_class=PreparedConnection,
+            init=self._init_connection,
+            server_settings=self._server_settings(application_name, readonly)
+        )
+    
+    def _server_settings(self, application_name: str, readonly: bool = False) -> Dict[str, str]:
+        """Session settings sent in the startup packet, so no extra round-trip"""
+        settings = {"application_name": application_name}
+        
+        # Our queries are short OLTP statements that JIT only slows. PgBouncer
+        # rejects startup parameters it doesn't track, so leave it to the server.
+        if not USE_PGBOUNCER:
+            settings["jit"] = "off"
+            
+            # Every transaction on a read pool is READ ONLY without paying
+            # for an explicit BEGIN ... COMMIT around each query
+            if readonly:
+                settings["default_transaction_read_only"] = "on"
+        
+        return settings
+    
+    async def _init_connection(self, conn: asyncpg.Connection):
+        """Per-connection setup: (de)serialize JSONB at the protocol layer"""
+        await conn.set_type_codec(
+            'jsonb',
+            encoder=_encode_jsonb,
+            decoder=_decode_jsonb,
+            schema='pg_catalog',
+            format='binary'
+        )
+        conn.statements = {}
+    
+    async def _prepared(
+        self, 
+        conn: PreparedConnection, 
+        name: str
+    ) -> Union[PreparedStatement, _UnpreparedStatement]:
+        """Get a connection's prepared statement, preparing it on first use"""
+        if USE_PGBOUNCER:
+            return _UnpreparedStatement(conn, PREPARED_STATEMENTS[name])
+        
+        stmt = conn.statements.get(name)
+        if stmt is None:
+            stmt = await conn.prepare(PREPARED_STATEMENTS[name])
+            conn.statements[name] = stmt
+        return stmt
+    
+    @asynccontextmanager
+    async def _acquire(self, readonly: bool = False):
+        """Acquire a pooled connection, reusing the one pinned by batch()
+        
+        Read-only callers get a replica connection when one is configured.
+        Inside batch() they stay on the pinned primary connection so they
+        see the block's own writes.
+        """
+        conn = _batch_connection.get()
+        if conn is not None:
+            yield conn
+            return
+        
+        pool = self.ro_pool if readonly and self.ro_pool else self.pool
+        async with pool.acquire() as conn:
+            yield conn
+    
+    @asynccontextmanager
+    async def batch(self):
+        """Run a burst of calls on a single connection and transaction
+        
+        Every DatabaseManager call awaited inside the block reuses the same
+        connection instead of acquiring one per call, and the writes commit
+        together. Calls must be awaited one after another: a connection
+        cannot run statements concurrently.
+        """
+        if _batch_connection.get() is not None:
+            yield self
+            return
+        
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                token = _batch_connection.set(conn)
+                try:
+                    yield self
+                finally:
+                    _batch_connection.reset(token)
+    
     async def _create_tables(self):
         """Create necessary database tables"""
         try:
-            async with self.pool.acquire() as conn:
-                # Usage tracking table
+            async with self._acquire() as conn:
+                # Usage tracking table, partitioned by month so indexes stay
+                # small and old months can be dropped with DETACH PARTITION
                 await conn.execute('''
                     CREATE TABLE IF NOT EXISTS token_usage (
-                        id SERIAL PRIMARY KEY,
+                        id SERIAL,
                         model_id VARCHAR(255) NOT NULL,
                         user_id VARCHAR(255) NOT NULL,
                         request_id VARCHAR(255),
@@ -68,10 +562,12 @@ class DatabaseManager:
                         estimated_cost DECIMAL(10, 6) NOT NULL DEFAULT 0.0,
                         currency VARCHAR(10) NOT NULL DEFAULT 'USD',
                         context JSONB,
-                        timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                    )
+                        timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+                        PRIMARY KEY (id, timestamp)
+                    ) PARTITION BY RANGE (timestamp)
                 ''')
+                await self._ensure_usage_partitions(conn)
                 
                 # Rule sets table
                 await conn.execute('''
@@ -120,11 +616,23 @@ class DatabaseManager:
                 ''')
                 
                 # Create indexes for better performance
+                # Usage queries filter on user/model equality plus a timestamp
+                # range and sort by timestamp, so index both columns together.
+                # The INCLUDE columns cover the report projections so they can
+                # be answered with index-only scans.
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_token_usage_user_ts ON token_usage(user_id, timestamp DESC)
+                    INCLUDE (model_id, input_tokens, output_tokens, total_tokens, estimated_cost, currency)
+                ''')
                 await conn.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_token_usage_model_id ON token_usage(model_id)
+                    CREATE INDEX IF NOT EXISTS idx_token_usage_model_ts ON token_usage(model_id, timestamp DESC)
+                    INCLUDE (user_id, input_tokens, output_tokens, total_tokens, estimated_cost, currency)
                 ''')
                 await conn.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_token_usage_user_id ON token_usage(user_id)
+                    DROP INDEX IF EXISTS idx_token_usage_model_id
+                ''')
+                await conn.execute('''
+                    DROP INDEX IF EXISTS idx_token_usage_user_id
                 ''')
                 await conn.execute('''
                     CREATE INDEX IF NOT EXISTS idx_token_usage_timestamp ON token_usage(timestamp)
@@ -132,59 +640,226 @@ class DatabaseManager:
                 await conn.execute('''
                     CREATE INDEX IF NOT EXISTS idx_rule_sets_active ON rule_sets(is_active)
                 ''')
+                await conn.execute('''
+                    DROP INDEX IF EXISTS idx_rule_sets_applies_models_gin
+                ''')
                 await conn.execute('''
                     CREATE INDEX IF NOT EXISTS idx_rule_usage_rule_set_id ON rule_usage(rule_set_id)
                 ''')
                 
+                # Broadcast rule set changes so every process can drop its
+                # cached copy. Usage counter bumps don't change the rules and
+                # are left out.
+                await conn.execute(f'''
+                    CREATE OR REPLACE FUNCTION notify_rule_set_changed() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'DELETE' THEN
+                            PERFORM pg_notify('{RULE_SET_CHANGED_CHANNEL}', OLD.rule_set_id);
+                        ELSE
+                            PERFORM pg_notify('{RULE_SET_CHANGED_CHANNEL}', NEW.rule_set_id);
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                ''')
+                await conn.execute('''
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (
+                            SELECT 1 FROM pg_trigger WHERE tgname = 'trg_rule_sets_notify_changed'
+                        ) THEN
+                            CREATE TRIGGER trg_rule_sets_notify_changed
+                            AFTER INSERT OR DELETE
+                                OR UPDATE OF name, description, rules, is_active, applies_to_models
+                            ON rule_sets
+                            FOR EACH ROW EXECUTE FUNCTION notify_rule_set_changed();
+                        END IF;
+                    END
+                    $$
+                ''')
+                
+                # Exact rule set counts kept up to date by trigger, so status
+                # checks read one row instead of scanning rule_sets
+                await conn.execute('''
+                    CREATE TABLE IF NOT EXISTS rule_sets_stats (
+                        id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+                        total BIGINT NOT NULL DEFAULT 0,
+                        active BIGINT NOT NULL DEFAULT 0
+                    )
+                ''')
+                await conn.execute('''
+                    CREATE OR REPLACE FUNCTION update_rule_sets_stats() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP = 'INSERT' THEN
+                            UPDATE rule_sets_stats SET
+                                total = total + 1,
+                                active = active + NEW.is_active::int;
+                        ELSIF TG_OP = 'DELETE' THEN
+                            UPDATE rule_sets_stats SET
+                                total = total - 1,
+                                active = active - OLD.is_active::int;
+                        ELSIF NEW.is_active IS DISTINCT FROM OLD.is_active THEN
+                            UPDATE rule_sets_stats SET
+                                active = active + NEW.is_active::int - OLD.is_active::int;
+                        END IF;
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql
+                ''')
+                await conn.execute('''
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (
+                            SELECT 1 FROM pg_trigger WHERE tgname = 'trg_rule_sets_stats'
+                        ) THEN
+                            CREATE TRIGGER trg_rule_sets_stats
+                            AFTER INSERT OR DELETE OR UPDATE OF is_active
+                            ON rule_sets
+                            FOR EACH ROW EXECUTE FUNCTION update_rule_sets_stats();
+                        END IF;
+                    END
+                    $$
+                ''')
+                # Seed from the table once; the trigger keeps it current after
+                await conn.execute('''
+                    INSERT INTO rule_sets_stats (id, total, active)
+                    SELECT true, COUNT(*), COUNT(*) FILTER (WHERE is_active)
+                    FROM rule_sets
+                    ON CONFLICT (id) DO NOTHING
+                ''')
+                
                 logger.info("Database tables created/verified successfully")
                 
         except Exception as e:
             logger.error(f"Error creating database tables: {e}")
             raise
     
+    async def _ensure_usage_partitions(self, conn: asyncpg.Connection):
+        """Create the current and upcoming monthly token_usage partitions"""
+        is_partitioned = await conn.fetchval(_SQL_USAGE_IS_PARTITIONED)
+        if not is_partitioned:
+            # Tables created before partitioning have to be migrated by hand
+            logger.warning("token_usage is not partitioned; skipping partition maintenance")
+            return
+        
+        # Rows outside every monthly range land here instead of failing
+        await conn.execute(_SQL_CREATE_USAGE_DEFAULT_PARTITION)
+        
+        now = datetime.now(timezone.utc)
+        for offset in range(USAGE_PARTITION_MONTHS_AHEAD + 1):
+            start = _month_start(now, offset)
+            end = _month_start(now, offset + 1)
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS token_usage_{start:%Y_%m}
+                PARTITION OF token_usage
+                FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+            ''')
+    
+    async def _listen_invalidations(self):
+        """Subscribe to rule set change notifications on a dedicated connection"""
+        try:
+            self._listener = await asyncpg.connect(self.connection_string)
+            await self._listener.add_listener(
+                RULE_SET_CHANGED_CHANNEL,
+                self._on_rule_set_changed
+            )
+        except Exception as e:
+            # Cached entries still expire after CONFIG_CACHE_TTL
+            logger.warning(f"Rule set change notifications unavailable: {e}")
+            self._listener = None
+    
+    def on_rule_set_changed(self, callback: Callable[[str], Any]):
+        """Call callback with the id of each rule set changed by any process"""
+        self._rule_set_callbacks.append(callback)
+    
+    def _on_rule_set_changed(self, conn, pid, channel, payload):
+        """Invalidate a rule set changed by any process"""
+        self._rule_set_cache.pop(payload)
+        for callback in self._rule_set_callbacks:
+            callback(payload)
+    
+    async def _partition_maintenance_loop(self):
+        """Background task that pre-creates next month's partition"""
+        while True:
+            try:
+                await asyncio.sleep(USAGE_PARTITION_CHECK_INTERVAL)
+                async with self._acquire() as conn:
+                    await self._ensure_usage_partitions(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error maintaining token_usage partitions: {e}")
+    
+    async def _periodic_ping(self):
+        """Background task that records when the database last answered"""
+        while True:
+            try:
+                await asyncio.sleep(PING_INTERVAL)
+                async with self._acquire() as conn:
+                    await conn.execute(_SQL_PING)
+                self._last_ok = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Database ping failed: {e}")
+    
     async def close(self):
         """Close database connection pool"""
+        if self._partition_task:
+            self._partition_task.cancel()
+            self._partition_task = None
+        
+        if self._ping_task:
+            self._ping_task.cancel()
+            self._ping_task = None
+        
+        if self._listener:
+            await self._listener.close()
+            self._listener = None
+        
         if self.pool:
+            # Write out anything still buffered before the pool goes away
+            await self._rule_usage_writer.stop()
+            await self._rule_usage_count_writer.stop()
             await self.pool.close()
+            
+            if self.ro_pool:
+                await self.ro_pool.close()
+                self.ro_pool = None
             logger.info("Database connection pool closed")
     
     async def is_connected(self) -> bool:
-        """Check if database is connected"""
-        if not self.pool:
+        """Check if database is connected, based on the last background ping"""
+        if not self.pool or self.pool.is_closing():
             return False
         
-        try:
-            async with self.pool.acquire() as conn:
-                await conn.execute("SELECT 1")
-                return True
-        except Exception:
-            return False
+        return time.monotonic() - self._last_ok < PING_STALE_AFTER
     
     # Token usage methods
-    async def insert_usage_record(self, usage_data: Dict[str, Any]):
-        """Insert a token usage record"""
+    async def insert_usage_records_bulk(self, rows: List[Dict[str, Any]]):
+        """Insert token usage records using the binary COPY protocol"""
+        if not rows:
+            return
+        
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO token_usage (
-                        model_id, user_id, request_id, input_tokens, output_tokens, 
-                        total_tokens, estimated_cost, currency, context, timestamp
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                ''', 
-                    usage_data["model_id"],
-                    usage_data["user_id"],
-                    usage_data["request_id"],
-                    usage_data["input_tokens"],
-                    usage_data["output_tokens"],
-                    usage_data["total_tokens"],
-                    usage_data["estimated_cost"],
-                    usage_data["currency"],
-                    usage_data["context"],
-                    usage_data["timestamp"]
-                )
+            records = [
+                tuple(row[column] for column in USAGE_COLUMNS)
+                for row in rows
+            ]
+            
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    # Usage rows are telemetry: skip the WAL flush wait on
+                    # commit for this transaction only
+                    await conn.execute(_SQL_SYNC_COMMIT_OFF)
+                    await conn.copy_records_to_table(
+                        'token_usage',
+                        records=records,
+                        columns=USAGE_COLUMNS
+                    )
                 
         except Exception as e:
-            logger.error(f"Error inserting usage record: {e}")
+            logger.error(f"Error inserting {len(rows)} usage records: {e}")
             raise
     
     async def get_user_usage(
@@ -192,80 +867,200 @@ class DatabaseManager:
         user_id: str, 
         start_date: datetime, 
         end_date: datetime
-    ) -> List[Dict[str, Any]]:
+    ) -> List[asyncpg.Record]:
         """Get usage records for a user within date range"""
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT * FROM token_usage 
-                    WHERE user_id = $1 AND timestamp >= $2 AND timestamp <= $3
-                    ORDER BY timestamp DESC
-                ''', user_id, start_date, end_date)
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_USER_USAGE, user_id, start_date, end_date)
                 
-                return [dict(row) for row in rows]
+                return rows
                 
         except Exception as e:
             logger.error(f"Error getting user usage: {e}")
             raise
     
-    async def get_total_usage(
+    async def get_user_usage_with_context(
         self, 
+        user_id: str, 
         start_date: datetime, 
         end_date: datetime
-    ) -> List[Dict[str, Any]]:
-        """Get total usage records within date range"""
+    ) -> List[asyncpg.Record]:
+        """Get full usage records, including request context, for a user"""
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT * FROM token_usage 
-                    WHERE timestamp >= $1 AND timestamp <= $2
-                    ORDER BY timestamp DESC
-                ''', start_date, end_date)
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_USER_USAGE_WITH_CONTEXT, user_id, start_date, end_date)
                 
-                return [dict(row) for row in rows]
+                return rows
                 
         except Exception as e:
-            logger.error(f"Error getting total usage: {e}")
+            logger.error(f"Error getting user usage with context: {e}")
             raise
-    
+
     async def get_model_usage(
         self, 
         model_id: str, 
         start_date: datetime, 
         end_date: datetime
-    ) -> List[Dict[str, Any]]:
+    ) -> List[asyncpg.Record]:
         """Get usage records for a specific model within date range"""
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT * FROM token_usage 
-                    WHERE model_id = $1 AND timestamp >= $2 AND timestamp <= $3
-                    ORDER BY timestamp DESC
-                ''', model_id, start_date, end_date)
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_MODEL_USAGE, model_id, start_date, end_date)
                 
-                return [dict(row) for row in rows]
+                return rows
                 
         except Exception as e:
             logger.error(f"Error getting model usage: {e}")
             raise
     
+    async def get_user_usage_summary(
+        self, 
+        user_id: str, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> List[asyncpg.Record]:
+        """Get a user's usage aggregated into hourly buckets"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_USER_USAGE_SUMMARY, user_id, start_date, end_date)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting user usage summary: {e}")
+            raise
+    
+    async def get_total_usage_by_model(
+        self, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> List[asyncpg.Record]:
+        """Get usage within date range aggregated per model"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_TOTAL_USAGE_BY_MODEL, start_date, end_date)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting total usage by model: {e}")
+            raise
+    
+    async def get_user_usage_by_model(
+        self, 
+        user_id: str, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> List[asyncpg.Record]:
+        """Get a user's usage within date range aggregated per model"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_USER_USAGE_BY_MODEL, user_id, start_date, end_date)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting user usage by model: {e}")
+            raise
+    
+    async def get_user_usage_by_day(
+        self, 
+        user_id: str, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> List[asyncpg.Record]:
+        """Get a user's usage aggregated per UTC day, newest first"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_USER_USAGE_BY_DAY, user_id, start_date, end_date)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting user usage by day: {e}")
+            raise
+    
+    async def get_total_usage_by_day(
+        self, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> List[asyncpg.Record]:
+        """Get usage within date range aggregated per UTC day, newest first"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_TOTAL_USAGE_BY_DAY, start_date, end_date)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting total usage by day: {e}")
+            raise
+    
+    async def get_top_users(
+        self, 
+        start_date: datetime, 
+        end_date: datetime,
+        limit: int = 10
+    ) -> List[asyncpg.Record]:
+        """Get the users with the highest cost within date range"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_TOP_USERS, start_date, end_date, limit)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting top users: {e}")
+            raise
+    
+    async def get_model_usage_totals(
+        self, 
+        model_id: str, 
+        start_date: datetime, 
+        end_date: datetime
+    ) -> asyncpg.Record:
+        """Get a model's summed usage within date range"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                row = await conn.fetchrow(_SQL_GET_MODEL_USAGE_TOTALS, model_id, start_date, end_date)
+                
+                return row
+                
+        except Exception as e:
+            logger.error(f"Error getting model usage totals: {e}")
+            raise
+    
+    async def get_model_top_users(
+        self, 
+        model_id: str, 
+        start_date: datetime, 
+        end_date: datetime,
+        limit: int = 5
+    ) -> List[asyncpg.Record]:
+        """Get the users with the highest cost on a model within date range"""
+        try:
+            async with self._acquire(readonly=True) as conn:
+                rows = await conn.fetch(_SQL_GET_MODEL_TOP_USERS, model_id, start_date, end_date, limit)
+                
+                return rows
+                
+        except Exception as e:
+            logger.error(f"Error getting model top users: {e}")
+            raise
+    
     # Rule sets methods
     async def insert_rule_set(self, rule_set_data: Dict[str, Any]):
         """Insert a new rule set"""
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO rule_sets (
-                        rule_set_id, name, description, rules, is_active, 
-                        applies_to_models, created_by, created_at, updated_at
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ''',
+            async with self._acquire() as conn:
+                await conn.execute(
+                    _SQL_INSERT_RULE_SET,
                     rule_set_data["rule_set_id"],
                     rule_set_data["name"],
                     rule_set_data["description"],
-                    json.dumps(rule_set_data["rules"]),
+                    rule_set_data["rules"],
                     rule_set_data["is_active"],
-                    json.dumps(rule_set_data["applies_to_models"]) if rule_set_data["applies_to_models"] else None,
+                    rule_set_data["applies_to_models"] or None,
                     rule_set_data["created_by"],
                     rule_set_data["created_at"],
                     rule_set_data["updated_at"]
@@ -275,50 +1070,37 @@ class DatabaseManager:
             logger.error(f"Error inserting rule set: {e}")
             raise
     
-    async def get_rule_set(self, rule_set_id: str) -> Optional[Dict[str, Any]]:
-        """Get a rule set by ID"""
+    async def get_rule_set(self, rule_set_id: str) -> Optional[asyncpg.Record]:
+        """Get a rule set by ID, served from the local cache when fresh"""
+        cached = self._rule_set_cache.get(rule_set_id)
+        if cached is not None:
+            return cached
+        
         try:
-            async with self.pool.acquire() as conn:
-                row = await conn.fetchrow('''
-                    SELECT * FROM rule_sets WHERE rule_set_id = $1
-                ''', rule_set_id)
-                
-                if row:
-                    result = dict(row)
-                    result["rules"] = json.loads(result["rules"]) if result["rules"] else []
-                    if result["applies_to_models"]:
-                        result["applies_to_models"] = json.loads(result["applies_to_models"])
-                    return result
-                return None
+            async with self._acquire() as conn:
+                stmt = await self._prepared(conn, "get_rule_set")
+                row = await stmt.fetchrow(rule_set_id)
+                
+                if row is None:
+                    return None
+                
+                self._rule_set_cache.set(rule_set_id, row)
+                return row
                 
         except Exception as e:
             logger.error(f"Error getting rule set: {e}")
             raise
     
-    async def list_rule_sets(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    async def list_rule_sets(self, user_id: Optional[str] = None) -> List[asyncpg.Record]:
         """List rule sets, optionally filtered by user"""
         try:
-            async with self.pool.acquire() as conn:
+            async with self._acquire(readonly=True) as conn:
                 if user_id:
-                    rows = await conn.fetch('''
-                        SELECT * FROM rule_sets 
-                        WHERE created_by = $1 OR created_by IS NULL
-                        ORDER BY created_at DESC
-                    ''', user_id)
+                    rows = await conn.fetch(_SQL_LIST_RULE_SETS_FOR_USER, user_id)
                 else:
-                    rows = await conn.fetch('''
-                        SELECT * FROM rule_sets ORDER BY created_at DESC
-                    ''')
-                
-                results = []
-                for row in rows:
-                    result = dict(row)
-                    result["rules"] = json.loads(result["rules"]) if result["rules"] else []
-                    if result["applies_to_models"]:
-                        result["applies_to_models"] = json.loads(result["applies_to_models"])
-                    results.append(result)
+                    rows = await conn.fetch(_SQL_LIST_RULE_SETS)
                 
-                return results
+                return rows
                 
         except Exception as e:
             logger.error(f"Error listing rule sets: {e}")
@@ -327,25 +1109,19 @@ class DatabaseManager:
     async def update_rule_set(self, rule_set_id: str, rule_set_data: Dict[str, Any]):
         """Update an existing rule set"""
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    UPDATE rule_sets SET 
-                        name = $2, 
-                        description = $3, 
-                        rules = $4, 
-                        is_active = $5, 
-                        applies_to_models = $6, 
-                        updated_at = $7
-                    WHERE rule_set_id = $1
-                ''',
+            async with self._acquire() as conn:
+                await conn.execute(
+                    _SQL_UPDATE_RULE_SET,
                     rule_set_id,
                     rule_set_data["name"],
                     rule_set_data["description"],
-                    json.dumps(rule_set_data["rules"]),
+                    rule_set_data["rules"],
                     rule_set_data["is_active"],
-                    json.dumps(rule_set_data["applies_to_models"]) if rule_set_data["applies_to_models"] else None,
+                    rule_set_data["applies_to_models"] or None,
                     rule_set_data["updated_at"]
                 )
+            
+            self._rule_set_cache.pop(rule_set_id)
                 
         except Exception as e:
             logger.error(f"Error updating rule set: {e}")
@@ -354,46 +1130,87 @@ class DatabaseManager:
     async def delete_rule_set(self, rule_set_id: str):
         """Delete a rule set"""
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    DELETE FROM rule_sets WHERE rule_set_id = $1
-                ''', rule_set_id)
+            async with self._acquire() as conn:
+                await conn.execute(_SQL_DELETE_RULE_SET, rule_set_id)
+            
+            self._rule_set_cache.pop(rule_set_id)
                 
         except Exception as e:
             logger.error(f"Error deleting rule set: {e}")
             raise
     
     async def track_rule_usage(self, usage_data: Dict[str, Any]):
-        """Track rule usage"""
+        """Queue a rule usage event for the next batched write"""
+        if not self._rule_usage_writer.running:
+            await self.track_rule_usage_many([usage_data])
+            return
+        
+        self._rule_usage_writer.put(usage_data)
+    
+    async def track_rule_usage_many(self, batch: List[Dict[str, Any]]):
+        """Record rule usage events and queue their rule set counter bumps"""
+        if not batch:
+            return
+        
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO rule_usage (rule_set_id, rules_applied, phase, timestamp)
-                    VALUES ($1, $2, $3, $4)
-                ''',
-                    usage_data["rule_set_id"],
-                    json.dumps(usage_data["rules_applied"]),
-                    usage_data["phase"],
-                    usage_data["timestamp"]
+            async with self._acquire() as conn:
+                rows = await conn.fetch(
+                    _SQL_INSERT_RULE_USAGE_BULK,
+                    *(
+                        [usage_data[column] for usage_data in batch]
+                        for column in RULE_USAGE_COLUMNS
+                    )
                 )
                 
-                # Update usage count in rule_sets table
-                await conn.execute('''
-                    UPDATE rule_sets SET 
-                        usage_count = usage_count + 1,
-                        last_used = $2
-                    WHERE rule_set_id = $1
-                ''', usage_data["rule_set_id"], usage_data["timestamp"])
-                
         except Exception as e:
             logger.error(f"Error tracking rule usage: {e}")
             raise
+        
+        if len(rows) < len(batch):
+            logger.warning(f"Dropped {len(batch) - len(rows)} rule usage events for deleted rule sets")
+        
+        # Only count hits that were recorded
+        hits = [(row["rule_set_id"], row["timestamp"]) for row in rows]
+        if not self._rule_usage_count_writer.running:
+            await self.increment_rule_usage_counts(hits)
+            return
+        
+        for hit in hits:
+            self._rule_usage_count_writer.put(hit)
+    
+    async def increment_rule_usage_counts(self, hits: List[tuple]):
+        """Apply (rule_set_id, timestamp) hits as one summed UPDATE of rule_sets"""
+        if not hits:
+            return
+        
+        deltas = Counter()
+        last_used: Dict[str, datetime] = {}
+        for rule_set_id, timestamp in hits:
+            deltas[rule_set_id] += 1
+            if rule_set_id not in last_used or timestamp > last_used[rule_set_id]:
+                last_used[rule_set_id] = timestamp
+        
+        # Lock rows in a stable order so concurrent workers can't deadlock
+        rule_set_ids = sorted(deltas)
+        
+        try:
+            async with self._acquire() as conn:
+                await conn.execute(
+                    _SQL_INCREMENT_RULE_USAGE,
+                    rule_set_ids,
+                    [deltas[rule_set_id] for rule_set_id in rule_set_ids],
+                    [last_used[rule_set_id] for rule_set_id in rule_set_ids]
+                )
+                
+        except Exception as e:
+            logger.error(f"Error updating rule usage counts: {e}")
+            raise
     
     async def count_rule_sets(self) -> int:
         """Count total rule sets"""
         try:
-            async with self.pool.acquire() as conn:
-                return await conn.fetchval('SELECT COUNT(*) FROM rule_sets')
+            async with self._acquire(readonly=True) as conn:
+                return await conn.fetchval(_SQL_COUNT_RULE_SETS) or 0
         except Exception as e:
             logger.error(f"Error counting rule sets: {e}")
             return 0
@@ -401,8 +1218,8 @@ class DatabaseManager:
     async def count_active_rule_sets(self) -> int:
         """Count active rule sets"""
         try:
-            async with self.pool.acquire() as conn:
-                return await conn.fetchval('SELECT COUNT(*) FROM rule_sets WHERE is_active = true')
+            async with self._acquire(readonly=True) as conn:
+                return await conn.fetchval(_SQL_COUNT_ACTIVE_RULE_SETS) or 0
         except Exception as e:
             logger.error(f"Error counting active rule sets: {e}")
             return 0
@@ -411,75 +1228,106 @@ class DatabaseManager:
     async def save_model_config(self, model_data: Dict[str, Any]):
         """Save or update model configuration"""
         try:
-            async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO model_configs (
-                        model_id, model_type, name, description, config, pricing,
-                        is_active, health_status, last_health_check, updated_at
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                    ON CONFLICT (model_id) DO UPDATE SET
-                        model_type = $2,
-                        name = $3,
-                        description = $4,
-                        config = $5,
-                        pricing = $6,
-                        is_active = $7,
-                        health_status = $8,
-                        last_health_check = $9,
-                        updated_at = $10
-                ''',
+            async with self._acquire() as conn:
+                await conn.execute(
+                    _SQL_SAVE_MODEL_CONFIG,
                     model_data["model_id"],
                     model_data["model_type"],
                     model_data["name"],
                     model_data["description"],
-                    json.dumps(model_data["config"]),
-                    json.dumps(model_data["pricing"]),
+                    model_data["config"],
+                    model_data["pricing"],
                     model_data["is_active"],
                     model_data["health_status"],
-                    model_data.get("last_health_check"),
-                    datetime.utcnow()
+                    model_data.get("last_health_check")
                 )
+            
+            self._model_config_cache.pop(model_data["model_id"])
                 
         except Exception as e:
             logger.error(f"Error saving model config: {e}")
             raise
-    
-    async def get_model_config(self, model_id: str) -> Optional[Dict[str, Any]]:
-        """Get model configuration"""
+
+    async def save_model_configs_bulk(self, models: List[Dict[str, Any]]):
+        """Save or update many model configurations in one statement
+
+        Each column is sent as an array and expanded with UNNEST, so the
+        whole set is parsed and planned once instead of once per model.
+        """
+        if not models:
+            return
+
+        # ON CONFLICT can't touch the same row twice in one statement
+        by_id = {model_data["model_id"]: model_data for model_data in models}
+        models = list(by_id.values())
+
         try:
-            async with self.pool.acquire() as conn:
-                row = await conn.fetchrow('''
-                    SELECT * FROM model_configs WHERE model_id = $1
-                ''', model_id)
-                
-                if row:
-                    result = dict(row)
-                    result["config"] = json.loads(result["config"]) if result["config"] else {}
-                    result["pricing"] = json.loads(result["pricing"]) if result["pricing"] else {}
-                    return result
-                return None
+            async with self._acquire() as conn:
+                await conn.execute(
+                    _SQL_SAVE_MODEL_CONFIGS_BULK,
+                    [model_data["model_id"] for model_data in models],
+                    [model_data["model_type"] for model_data in models],
+                    [model_data["name"] for model_data in models],
+                    [model_data["description"] for model_data in models],
+                    [model_data["config"] for model_data in models],
+                    [model_data["pricing"] for model_data in models],
+                    [model_data["is_active"] for model_data in models],
+                    [model_data["health_status"] for model_data in models],
+                    [model_data.get("last_health_check") for model_data in models]
+                )
+
+            for model_id in by_id:
+                self._model_config_cache.pop(model_id)
+
+        except Exception as e:
+            logger.error(f"Error saving {len(models)} model configs: {e}")
+            raise
+
+    async def get_model_config(self, model_id: str) -> Optional[asyncpg.Record]:
+        """Get model configuration, served from the local cache when fresh"""
+        cached = self._model_config_cache.get(model_id)
+        if cached is not None:
+            return cached
+        
+        try:
+            async with self._acquire() as conn:
+                stmt = await self._prepared(conn, "get_model_config")
+                row = await stmt.fetchrow(model_id)
+                
+                if row is None:
+                    return None
+                
+                self._model_config_cache.set(model_id, row)
+                return row
                 
         except Exception as e:
             logger.error(f"Error getting model config: {e}")
             raise
     
     async def get_status(self) -> Dict[str, Any]:
-        """Get database status"""
+        """Get database status, reusing a result younger than STATUS_CACHE_TTL"""
+        if not self.pool:
+            return {"status": "not_initialized"}
+        
+        async with self._status_lock:
+            status = self._status_cache.get("status")
+            if status is None:
+                status = await self._collect_status()
+                self._status_cache.set("status", status)
+            return status
+    
+    async def _collect_status(self) -> Dict[str, Any]:
+        """Gather database status from cheap statistics sources"""
         try:
-            if not self.pool:
-                return {"status": "not_initialized"}
-            
-            async with self.pool.acquire() as conn:
-                # Get basic stats
-                usage_count = await conn.fetchval('SELECT COUNT(*) FROM token_usage')
-                rule_sets_count = await conn.fetchval('SELECT COUNT(*) FROM rule_sets')
-                models_count = await conn.fetchval('SELECT COUNT(*) FROM model_configs')
+            async with self._acquire() as conn:
+                # Planner estimate summed over the partitions: free, and
+                # close enough for a status page
+                usage_count = await conn.fetchval(_SQL_ESTIMATE_USAGE_ROWS)
+                rule_sets_count = await conn.fetchval(_SQL_COUNT_RULE_SETS)
+                models_count = await conn.fetchval(_SQL_COUNT_MODELS)
                 
                 # Get recent activity
-                recent_usage = await conn.fetchval('''
-                    SELECT COUNT(*) FROM token_usage 
-                    WHERE timestamp >= NOW() - INTERVAL '24 hours'
-                ''')
+                recent_usage = await conn.fetchval(_SQL_COUNT_RECENT_USAGE)
                 
                 return {
                     "status": "healthy",
@@ -487,15 +1335,15 @@ class DatabaseManager:
                     "pool_max_size": self.pool.get_max_size(),
                     "pool_min_size": self.pool.get_min_size(),
                     "total_usage_records": usage_count,
-                    "total_rule_sets": rule_sets_count,
+                    "total_rule_sets": rule_sets_count or 0,
                     "total_models": models_count,
                     "recent_24h_usage": recent_usage,
-                    "last_check": datetime.utcnow().isoformat()
+                    "last_check": datetime.now(timezone.utc).isoformat()
                 }
                 
         except Exception as e:
             return {
                 "status": "unhealthy",
                 "error": str(e),
-                "last_check": datetime.utcnow().isoformat()
-            }
\ No newline at end of file
+                "last_check": datetime.now(timezone.utc).isoformat()
+            }
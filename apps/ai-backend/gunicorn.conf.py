@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration - Production process manager for the AI backend
+
+Run with: gunicorn -c gunicorn.conf.py main:app
+"""
+
+import os
+
+bind = f"{os.getenv('AI_BACKEND_HOST', '0.0.0.0')}:{os.getenv('AI_BACKEND_PORT', '8002')}"
+
+# One event loop per core; each worker holds its own DB pool and model state,
+# so size AI_DB_POOL_MAX so that workers * max stays under the server limit
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Heartbeat files on tmpfs so workers are never blocked on disk I/O
+worker_tmp_dir = "/dev/shm"
+keepalive = 30
+
+# Per-request access lines are costly at high request rates; use WARNING in production
+loglevel = os.getenv("AI_BACKEND_LOG_LEVEL", "INFO").lower()
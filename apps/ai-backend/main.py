@@ -3,25 +3,32 @@ AI Backend Service - FastAPI application for multi-model AI orchestration
 Supports OpenAI, Anthropic, and open-source models with token pricing and custom rules
 """
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from contextlib import asynccontextmanager
+import orjson
 import uvicorn
 import logging
 from typing import Dict, List, Optional, Any
 import asyncio
 from datetime import datetime
 import os
+import uuid
 from dotenv import load_dotenv
+from pydantic import ValidationError
 
 from models.model_manager import ModelManager
 from models.token_tracker import TokenTracker
 from rules.rule_engine import RuleEngine
 from schemas.ai_schemas import (
-    AIRequest, AIResponse, ModelConfig, TokenUsage,
+    AIRequest, AIResponse, TokenUsage,
     CustomRule, RuleSet, ModelStats
 )
 from database.db_manager import DatabaseManager
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 # Load environment variables
@@ -30,6 +37,23 @@ load_dotenv()
 # Setup logging
 logger = setup_logger(__name__)
 
+# Server-sent event framing; proxies must not buffer the stream
+SSE_DATA = b"data: "
+SSE_END = b"\n\n"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Generation admission control; requests wait at most ADMIT_TIMEOUT for a slot
+MAX_INFLIGHT_GENERATE = int(os.getenv("MAX_INFLIGHT_GENERATE", "64"))
+MAX_INFLIGHT_STREAM = int(os.getenv("MAX_INFLIGHT_STREAM", "16"))
+ADMIT_TIMEOUT = 0.1
+
+# Batch-priority requests (context["priority"] == "batch") sent to the OpenAI Batch API
+# may take up to 24h; they run as background jobs instead of holding a slot and an
+# open connection
+MAX_PENDING_BATCH_JOBS = int(os.getenv("MAX_PENDING_BATCH_JOBS", "10000"))
+BATCH_JOB_PENDING_TTL = 25 * 60 * 60
+BATCH_JOB_RESULT_TTL = 3600
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
@@ -43,13 +67,28 @@ async def lifespan(app: FastAPI):
     await app.state.model_manager.initialize()
     
     app.state.token_tracker = TokenTracker(app.state.db_manager)
+    app.state.token_tracker.start()
     app.state.rule_engine = RuleEngine(app.state.db_manager)
     
+    # Cap concurrent upstream generations; streams hold a slot for their lifetime
+    app.state.generate_slots = asyncio.Semaphore(MAX_INFLIGHT_GENERATE)
+    app.state.stream_slots = asyncio.Semaphore(MAX_INFLIGHT_STREAM)
+    
+    app.state.batch_jobs = TTLCache(maxsize=MAX_PENDING_BATCH_JOBS * 2, ttl=BATCH_JOB_RESULT_TTL)
+    app.state.batch_tasks = {}
+    
     logger.info("AI Backend Service started successfully")
     yield
     
     # Cleanup
     logger.info("Shutting down AI Backend Service...")
+    batch_tasks = list(app.state.batch_tasks.values())
+    for task in batch_tasks:
+        task.cancel()
+    if batch_tasks:
+        await asyncio.gather(*batch_tasks, return_exceptions=True)
+    await app.state.token_tracker.close()
+    await app.state.model_manager.close()
     await app.state.db_manager.close()
 
 # Create FastAPI app
@@ -57,7 +96,8 @@ app = FastAPI(
     title="AI Backend Service",
     description="Multi-model AI orchestration service with custom rules and token tracking",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -81,12 +121,14 @@ async def health_check():
     }
 
 # Model management endpoints
-@app.get("/models", response_model=List[ModelConfig])
+@app.get("/models")
 async def list_models():
     """List all available AI models"""
     try:
-        models = await app.state.model_manager.list_models()
-        return models
+        return Response(
+            content=app.state.model_manager.list_models_json(),
+            media_type="application/json"
+        )
     except Exception as e:
         logger.error(f"Error listing models: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -102,59 +144,153 @@ async def get_model_stats(model_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # AI generation endpoints
-@app.post("/generate", response_model=AIResponse)
-async def generate_response(
-    request: AIRequest,
-    background_tasks: BackgroundTasks
-):
-    """Generate AI response using the best available model"""
+# Generation endpoints parse their body themselves, so document it explicitly
+AI_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": AIRequest.model_json_schema()}}
+    }
+}
+
+async def parse_ai_request(http_request: Request) -> AIRequest:
+    """Validate an AIRequest straight from the raw JSON bytes"""
     try:
-        # Apply custom rules if specified
-        if request.rule_set_id:
-            rules = await app.state.rule_engine.get_rule_set(request.rule_set_id)
-            request = await app.state.rule_engine.apply_input_rules(request, rules)
-        
-        # Generate response using model manager
-        response = await app.state.model_manager.generate(request)
+        return AIRequest.model_validate_json(await http_request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+async def acquire_slot(slots: asyncio.Semaphore):
+    """Take a generation slot, failing fast with 429 when the server is saturated"""
+    try:
+        await asyncio.wait_for(slots.acquire(), ADMIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=429, detail="Server busy")
+
+async def run_generation(request: AIRequest) -> AIResponse:
+    """Apply rules, generate, and queue token usage for a request"""
+    # Apply custom rules if specified
+    rules = None
+    if request.rule_set_id:
+        rules = await app.state.rule_engine.get_rule_set(request.rule_set_id)
+        request = await app.state.rule_engine.apply_input_rules(request, rules)
+    
+    # Generate response using model manager
+    response = await app.state.model_manager.generate(request)
+    
+    # Apply output rules with the same rule set
+    if rules is not None:
+        response = await app.state.rule_engine.apply_output_rules(response, rules)
+    
+    # Queue token usage; a drain task writes it in batches
+    app.state.token_tracker.enqueue_usage(
+        response.model_used,
+        response.token_usage,
+        request.user_id or "anonymous",
+        request_id=response.request_id
+    )
+    
+    return response
+
+async def run_batch_job(job_id: str, request: AIRequest):
+    """Run a batch-priority generation, recording its outcome under job_id"""
+    job = {"job_id": job_id, "status": "queued"}
+    try:
+        response = await run_generation(request)
+        job["status"] = "completed"
+        job["response"] = response.model_dump(mode="json")
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except Exception as e:
+        logger.error(f"Error running batch job {job_id}: {e}")
+        job["status"] = "error"
+        job["error"] = str(e)
+    finally:
+        app.state.batch_jobs.set(job_id, job)
+        app.state.batch_tasks.pop(job_id, None)
+
+@app.post("/generate", response_model=AIResponse, openapi_extra=AI_REQUEST_BODY)
+async def generate_response(request: AIRequest = Depends(parse_ai_request)):
+    """Generate AI response using the best available model
+    
+    Batch-priority requests routed to a batch API return 202 with a job id;
+    poll /generate/jobs/{job_id}.
+    """
+    # Only requests that really go to a batch API run as jobs; on other providers
+    # they are answered directly and admitted like any other request
+    batch_model = None
+    if request.context and request.context.get("priority") == "batch":
+        batch_model = await app.state.model_manager.select_batch_model(request)
+    
+    if batch_model is not None:
+        if len(app.state.batch_tasks) >= MAX_PENDING_BATCH_JOBS:
+            raise HTTPException(status_code=429, detail="Too many pending batch jobs")
         
-        # Apply output rules if specified
-        if request.rule_set_id:
-            rules = await app.state.rule_engine.get_rule_set(request.rule_set_id)
-            response = await app.state.rule_engine.apply_output_rules(response, rules)
+        # Keep the job on the batch-capable model chosen here
+        request.preferred_model = batch_model
         
-        # Track token usage in background
-        background_tasks.add_task(
-            app.state.token_tracker.track_usage,
-            response.model_used,
-            response.token_usage,
-            request.user_id or "anonymous"
-        )
+        job_id = f"job_{uuid.uuid4().hex}"
+        job = {"job_id": job_id, "status": "queued"}
+        app.state.batch_jobs.set(job_id, job, ttl=BATCH_JOB_PENDING_TTL)
+        app.state.batch_tasks[job_id] = asyncio.create_task(run_batch_job(job_id, request))
+        return ORJSONResponse(job, status_code=202)
+    
+    await acquire_slot(app.state.generate_slots)
+    try:
+        response = await run_generation(request)
         
-        return response
+        # Already validated; serialize directly instead of re-validating as response_model
+        return Response(content=response.model_dump_json(), media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error generating response: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        app.state.generate_slots.release()
 
-@app.post("/generate/stream")
-async def generate_stream(request: AIRequest):
+@app.post("/generate/stream", openapi_extra=AI_REQUEST_BODY)
+async def generate_stream(request: AIRequest = Depends(parse_ai_request)):
     """Generate streaming AI response"""
+    await acquire_slot(app.state.stream_slots)
+    
+    # Released when the stream ends, or when the response is torn down if the
+    # client left before the body started (the generator's finally never runs then)
+    released = False
+    
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            app.state.stream_slots.release()
+    
     try:
         async def event_generator():
-            async for chunk in app.state.model_manager.generate_stream(request):
-                yield f"data: {chunk.json()}\n\n"
+            try:
+                async for chunk in app.state.model_manager.generate_stream(request):
+                    yield SSE_DATA + orjson.dumps(chunk.__dict__, default=str) + SSE_END
+            finally:
+                release_slot()
         
-        from fastapi.responses import StreamingResponse
         return StreamingResponse(
             event_generator(),
-            media_type="text/plain",
-            headers={"Cache-Control": "no-cache"}
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+            background=BackgroundTask(release_slot)
         )
         
     except Exception as e:
+        release_slot()
         logger.error(f"Error generating stream: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/generate/jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Get the status, and once completed the response, of a batch-priority generation"""
+    job = app.state.batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # Custom rules endpoints
 @app.post("/rules/sets", response_model=RuleSet)
 async def create_rule_set(rule_set: RuleSet):
@@ -176,7 +312,7 @@ async def list_rule_sets(user_id: Optional[str] = None):
         logger.error(f"Error listing rule sets: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/rules/sets/{rule_set_id}", response_model=RuleSet)
+@app.get("/rules/sets/{rule_set_id}")
 async def get_rule_set(rule_set_id: str):
     """Get a specific rule set"""
     try:
@@ -256,6 +392,20 @@ async def configure_model(model_id: str, config: dict):
         logger.error(f"Error configuring model: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/models/{model_id}/pulls/{job_id}")
+async def get_pull_status(model_id: str, job_id: str):
+    """Get progress of a background model pull started via configure"""
+    try:
+        status = app.state.model_manager.get_pull_status(model_id, job_id)
+        if not status:
+            raise HTTPException(status_code=404, detail="Pull job not found")
+        return status
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting pull status: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/models/{model_id}/test")
 async def test_model(model_id: str, test_request: AIRequest):
     """Test a specific model with a sample request"""
@@ -263,7 +413,7 @@ async def test_model(model_id: str, test_request: AIRequest):
         # Force use of specific model
         test_request.preferred_model = model_id
         response = await app.state.model_manager.generate(test_request)
-        return response
+        return Response(content=response.model_dump_json(), media_type="application/json")
     except Exception as e:
         logger.error(f"Error testing model: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -297,10 +447,15 @@ async def system_status():
 
 if __name__ == "__main__":
     port = int(os.getenv("AI_BACKEND_PORT", 8002))
+    # Auto-reload is for local development only and can't be combined with workers
+    reload = os.getenv("AI_BACKEND_RELOAD", "false").lower() in ("1", "true", "yes")
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=port,
-        reload=True,
-        log_level="info"
+        loop="uvloop",
+        http="httptools",
+        workers=None if reload else int(os.getenv("WEB_CONCURRENCY", 1)),
+        reload=reload,
+        log_level=os.getenv("AI_BACKEND_LOG_LEVEL", "INFO").lower()
     )
\ No newline at end of file
@@ -3,12 +3,19 @@ Model Manager - Orchestrates multiple AI models and handles fallbacks
 """
 
 import asyncio
+import bisect
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any, AsyncGenerator
+from typing import Dict, List, Optional, Any, AsyncGenerator, Tuple
 import time
 import json
+import uuid
+from collections import Counter, deque
 from datetime import datetime, timedelta
 import aiohttp
+import httpx
+import openai
+import orjson
 import os
 
 from schemas.ai_schemas import (
@@ -19,58 +26,145 @@ from models.providers.openai_provider import OpenAIProvider
 from models.providers.anthropic_provider import AnthropicProvider
 from models.providers.huggingface_provider import HuggingFaceProvider
 from models.providers.ollama_provider import OllamaProvider
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Selection score bonuses (can be customized)
+MODEL_TYPE_PREFERENCE = {
+    ModelType.ANTHROPIC: 10,  # Slight preference for Anthropic
+    ModelType.OPENAI: 8,
+    ModelType.OLLAMA: 15,  # Prefer local models for cost
+}
+CAPABILITY_BONUS = 20
+
+# Number of recent response times averaged per model
+RESPONSE_TIME_WINDOW = 100
+
+# Circuit breaker: consecutive failures before a model is taken out of rotation,
+# and seconds between recovery probes while it is out
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# Providers whose failure to initialize is logged rather than fatal
+OPTIONAL_PROVIDERS = {"ollama"}
+
+# Shared HTTP client used by the hosted API providers; idle connections are kept
+# long enough to bridge bursty traffic without new TLS handshakes
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=128, keepalive_expiry=60.0)
+
+# Exact-match response cache
+RESPONSE_CACHE_ENABLED = os.getenv("ENABLE_RESPONSE_CACHE", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_SIZE = 10000
+RESPONSE_CACHE_FIELDS = {
+    "prompt", "context", "preferred_model", "max_tokens",
+    "temperature", "top_p", "top_k", "message_type", "language"
+}
+
+def _is_provider_failure(error: Exception) -> bool:
+    """Whether an error means the model's backend is failing rather than the request being bad"""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (
+        asyncio.TimeoutError,
+        ConnectionError,
+        aiohttp.ClientError,
+        httpx.TransportError,
+        openai.APIConnectionError
+    ))
+
+def _flat_rates(pricing: ModelPricing) -> Tuple[float, float, float]:
+    """(input rate, output rate, flat cost) such that cost = in*rate + out*rate + flat"""
+    if pricing.pricing_model is PricingModel.PER_TOKEN:
+        return float(pricing.input_token_cost), float(pricing.output_token_cost), 0.0
+    elif pricing.pricing_model is PricingModel.PER_REQUEST:
+        return 0.0, 0.0, float(pricing.request_cost)
+    else:
+        return 0.0, 0.0, 0.0
+
 class ModelManager:
     """Manages multiple AI model providers and handles orchestration"""
     
     def __init__(self):
         self.providers: Dict[str, Any] = {}
+        self.http: Optional[httpx.AsyncClient] = None
         self.models: Dict[str, ModelConfig] = {}
         self.health_status: Dict[str, bool] = {}
         self.last_health_check: Dict[str, datetime] = {}
-        self.request_counts: Dict[str, int] = {}
-        self.response_times: Dict[str, List[float]] = {}
+        self.request_counts: Counter = Counter()
+        self.response_times: Dict[str, deque] = {}
+        self._rt_sum: Dict[str, float] = {}
+        
+        # Provider that serves each model, resolved once at load time
+        self._model_providers: Dict[str, Any] = {}
+        
+        # (input rate, output rate, flat cost) per model
+        self._pricing_flat: Dict[str, Tuple[float, float, float]] = {}
+        
+        # Selectable models ranked by their request-independent score
+        self._model_scores: Dict[str, float] = {}
+        self._ranked_models: List[Tuple[float, str]] = []
+        
+        # Pre-rendered /models payload, rebuilt whenever a model config changes
+        self._models_blob: Optional[bytes] = None
+        
+        # Per-model circuit breaker driven by request outcomes
+        self._breaker: Dict[str, Dict[str, Any]] = {}
+        self._probe_tasks: Dict[str, asyncio.Task] = {}
+        
+        # Serializes reloads, health sweeps and reconfiguration within a worker
+        self._lock = asyncio.Lock()
+        
+        # Responses keyed by a digest of the generation inputs
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
         
     async def initialize(self):
         """Initialize all model providers"""
         logger.info("Initializing AI model providers...")
         
+        # One pooled HTTP/2 client so connections and TLS sessions are reused
+        self.http = httpx.AsyncClient(
+            http2=True,
+            timeout=HTTP_TIMEOUT,
+            limits=HTTP_LIMITS
+        )
+        
         try:
-            # Initialize OpenAI provider
             if os.getenv("OPENAI_API_KEY"):
-                self.providers["openai"] = OpenAIProvider()
-                await self.providers["openai"].initialize()
-                logger.info("OpenAI provider initialized")
+                self.providers["openai"] = OpenAIProvider(http=self.http)
             
-            # Initialize Anthropic provider
             if os.getenv("ANTHROPIC_API_KEY"):
                 self.providers["anthropic"] = AnthropicProvider()
-                await self.providers["anthropic"].initialize()
-                logger.info("Anthropic provider initialized")
             
-            # Initialize HuggingFace provider
             if os.getenv("HUGGINGFACE_API_KEY"):
                 self.providers["huggingface"] = HuggingFaceProvider()
-                await self.providers["huggingface"].initialize()
-                logger.info("HuggingFace provider initialized")
             
-            # Initialize Ollama provider (local models)
-            try:
-                self.providers["ollama"] = OllamaProvider()
-                await self.providers["ollama"].initialize()
-                logger.info("Ollama provider initialized")
-            except Exception as e:
-                logger.warning(f"Ollama provider failed to initialize: {e}")
+            # Ollama serves local models and needs no API key
+            self.providers["ollama"] = OllamaProvider()
             
-            # Load model configurations
-            await self._load_model_configs()
+            # Providers are independent, so connect to all of them at once
+            results = await asyncio.gather(
+                *(provider.initialize() for provider in self.providers.values()),
+                return_exceptions=True
+            )
             
-            # Start health check background task
-            asyncio.create_task(self._health_check_loop())
+            for provider_name, result in zip(list(self.providers), results):
+                if not isinstance(result, Exception):
+                    logger.info(f"{provider_name} provider initialized")
+                elif provider_name in OPTIONAL_PROVIDERS:
+                    logger.warning(f"{provider_name} provider failed to initialize: {result}")
+                    del self.providers[provider_name]
+                else:
+                    raise result
             
+            # Load model configurations
+            await self._load_model_configs()
+                        
             logger.info(f"Model manager initialized with {len(self.models)} models")
             
         except Exception as e:
@@ -79,60 +173,184 @@ class ModelManager:
     
     async def _load_model_configs(self):
         """Load model configurations from all providers"""
-        self.models = {}
+        async with self._lock:
+            # Fetch everything first so requests never see a half-built model map
+            loaded = []
+            for provider_name, provider in self.providers.items():
+                try:
+                    for model in await provider.get_available_models():
+                        loaded.append((provider, model))
+                except Exception as e:
+                    logger.error(f"Error loading models from {provider_name}: {e}")
+            
+            models = {}
+            model_providers = {}
+            pricing_flat = {}
+            for provider, model in loaded:
+                models[model.model_id] = model
+                model_providers[model.model_id] = provider
+                self.health_status[model.model_id] = True
+                self._breaker[model.model_id] = self._closed_breaker()
+                self.request_counts[model.model_id] = 0
+                self.response_times[model.model_id] = deque(maxlen=RESPONSE_TIME_WINDOW)
+                self._rt_sum[model.model_id] = 0.0
+                pricing_flat[model.model_id] = _flat_rates(model.pricing)
+            
+            self.models = models
+            self._model_providers = model_providers
+            self._pricing_flat = pricing_flat
+            self._rank_models()
+            self._render_models()
+    
+    @staticmethod
+    def _closed_breaker() -> Dict[str, Any]:
+        return {"state": "closed", "failures": 0, "opened_at": 0.0}
+    
+    def _record_failure(self, model_id: str):
+        """Count a failed request and take the model out of rotation at the threshold"""
+        breaker = self._breaker.setdefault(model_id, self._closed_breaker())
+        breaker["failures"] += 1
         
-        for provider_name, provider in self.providers.items():
-            try:
-                provider_models = await provider.get_available_models()
-                for model in provider_models:
-                    self.models[model.model_id] = model
-                    self.health_status[model.model_id] = True
-                    self.request_counts[model.model_id] = 0
-                    self.response_times[model.model_id] = []
-                    
-            except Exception as e:
-                logger.error(f"Error loading models from {provider_name}: {e}")
+        # A half-open model gets a single trial request
+        if breaker["state"] == "half_open" or (
+            breaker["state"] == "closed" and breaker["failures"] >= BREAKER_FAILURE_THRESHOLD
+        ):
+            breaker["state"] = "open"
+            breaker["opened_at"] = time.monotonic()
+            self._set_model_health(model_id, False)
+            logger.warning(f"Circuit opened for model {model_id} after {breaker['failures']} failures")
+            
+            if model_id not in self._probe_tasks:
+                self._probe_tasks[model_id] = asyncio.create_task(self._probe_until_healthy(model_id))
     
-    async def _health_check_loop(self):
-        """Background task to check model health"""
-        while True:
-            try:
-                await asyncio.sleep(300)  # Check every 5 minutes
-                await self._check_all_models_health()
-            except Exception as e:
-                logger.error(f"Error in health check loop: {e}")
+    def _record_success(self, model_id: str):
+        """Reset the breaker after a successful request"""
+        breaker = self._breaker.get(model_id)
+        if breaker is None or (breaker["state"] == "closed" and not breaker["failures"]):
+            return
+        
+        if breaker["state"] != "closed":
+            logger.info("Circuit closed for model %s", model_id)
+        self._breaker[model_id] = self._closed_breaker()
     
-    async def _check_all_models_health(self):
-        """Check health of all models"""
-        for model_id, model_config in self.models.items():
-            try:
-                provider = self.providers.get(model_config.model_type.value)
-                if provider:
+    async def _probe_until_healthy(self, model_id: str):
+        """Probe an open model after each cooldown and let traffic back in once it answers"""
+        try:
+            while self._breaker.get(model_id, {}).get("state") == "open":
+                await asyncio.sleep(BREAKER_COOLDOWN)
+                
+                provider = self._model_providers.get(model_id)
+                if provider is None or self._breaker.get(model_id, {}).get("state") != "open":
+                    return
+                
+                try:
                     is_healthy = await provider.check_health(model_id)
-                    self.health_status[model_id] = is_healthy
-                    self.last_health_check[model_id] = datetime.utcnow()
-                    
-                    # Update model config
-                    model_config.health_status = "healthy" if is_healthy else "unhealthy"
-                    model_config.last_health_check = self.last_health_check[model_id]
-                    
-            except Exception as e:
-                logger.error(f"Health check failed for model {model_id}: {e}")
-                self.health_status[model_id] = False
+                except Exception as e:
+                    logger.error(f"Health probe failed for model {model_id}: {e}")
+                    is_healthy = False
+                
+                if is_healthy and self._breaker[model_id]["state"] == "open":
+                    self._breaker[model_id]["state"] = "half_open"
+                    self._set_model_health(model_id, True)
+                    logger.info("Circuit half-open for model %s", model_id)
+        finally:
+            self._probe_tasks.pop(model_id, None)
+    
+    def _set_model_health(self, model_id: str, is_healthy: bool):
+        """Record a health change and move the model in or out of the ranking"""
+        self.health_status[model_id] = is_healthy
+        self.last_health_check[model_id] = datetime.utcnow()
+        
+        model_config = self.models.get(model_id)
+        if model_config:
+            model_config.health_status = "healthy" if is_healthy else "unhealthy"
+            model_config.last_health_check = self.last_health_check[model_id]
+            self._render_models()
+        
+        self._rerank_model(model_id)
     
     async def list_models(self) -> List[ModelConfig]:
         """List all available models"""
         return list(self.models.values())
     
+    def list_models_json(self) -> bytes:
+        """All available models as a pre-rendered JSON array"""
+        if self._models_blob is None:
+            self._render_models()
+        return self._models_blob
+    
+    def _render_models(self):
+        """Re-render the cached JSON for list_models_json"""
+        self._models_blob = orjson.dumps(
+            [model.model_dump(mode="json") for model in self.models.values()]
+        )
+    
     async def get_model(self, model_id: str) -> Optional[ModelConfig]:
         """Get specific model configuration"""
         return self.models.get(model_id)
     
     async def generate(self, request: AIRequest) -> AIResponse:
         """Generate AI response using the best available model"""
-        start_time = time.time()
-        request_id = f"req_{int(time.time() * 1000)}"
+        start_ns = time.monotonic_ns()
+        request_id = f"req_{uuid.uuid4().hex[:12]}"
+        
+        cache_key = self._response_cache_key(request)
+        if cache_key is not None:
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                return self._cached_response(cached, request_id, start_ns)
         
+        response = await self._generate(request, request_id, start_ns)
+        
+        if cache_key is not None:
+            # Store a private copy; output rules mutate the returned response
+            self._response_cache.set(cache_key, response.model_copy(deep=True))
+        return response
+    
+    async def select_batch_model(self, request: AIRequest) -> Optional[str]:
+        """Model a batch-priority request would run on, if its provider submits through a batch API"""
+        model_id = await self._select_best_model(request)
+        provider = self._model_providers.get(model_id)
+        if provider is not None and hasattr(provider, "generate_batched"):
+            return model_id
+        return None
+    
+    def _response_cache_key(self, request: AIRequest) -> Optional[bytes]:
+        """Digest of the fields that determine a response, or None if uncacheable"""
+        if not RESPONSE_CACHE_ENABLED or not request.cache_response:
+            return None
+        
+        if (request.context or {}).get("no_cache"):
+            return None
+        
+        try:
+            payload = orjson.dumps(
+                request.model_dump(include=RESPONSE_CACHE_FIELDS),
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+            )
+        except TypeError:
+            return None
+        
+        return hashlib.blake2b(payload, digest_size=16).digest()
+    
+    def _cached_response(self, cached: AIResponse, request_id: str, start_ns: int) -> AIResponse:
+        """Re-issue a cached response under a new request id at no upstream cost"""
+        usage = cached.token_usage.model_copy(update={
+            "cached_tokens": cached.token_usage.total_tokens,
+            "estimated_cost": 0.0
+        })
+        
+        logger.debug("Served response from cache (originally %s)", cached.model_used)
+        return cached.model_copy(deep=True, update={
+            "request_id": request_id,
+            "timestamp": datetime.utcnow(),
+            "processing_time_ms": (time.monotonic_ns() - start_ns) / 1_000_000,
+            "token_usage": usage,
+            "estimated_cost": 0.0
+        })
+    
+    async def _generate(self, request: AIRequest, request_id: str, start_ns: int) -> AIResponse:
+        """Generate a response upstream, falling back to the request's fallback models"""
         # Determine which model to use
         model_to_use = await self._select_best_model(request)
         if not model_to_use:
@@ -140,8 +358,7 @@ class ModelManager:
         
         try:
             # Get the provider for this model
-            model_config = self.models[model_to_use]
-            provider = self.providers.get(model_config.model_type.value)
+            provider = self._model_providers.get(model_to_use)
             
             if not provider:
                 raise Exception(f"Provider not available for model {model_to_use}")
@@ -152,27 +369,27 @@ class ModelManager:
             # Update response metadata
             response.request_id = request_id
             response.model_used = model_to_use
-            response.processing_time_ms = (time.time() - start_time) * 1000
+            response.processing_time_ms = (time.monotonic_ns() - start_ns) / 1_000_000
             
             # Calculate estimated cost
-            response.estimated_cost = await self._calculate_cost(
+            response.estimated_cost = self._calculate_cost(
                 model_to_use, response.token_usage
             )
             
             # Update statistics
-            self.request_counts[model_to_use] += 1
-            self.response_times[model_to_use].append(response.processing_time_ms)
-            
-            # Keep only last 100 response times for averaging
-            if len(self.response_times[model_to_use]) > 100:
-                self.response_times[model_to_use] = self.response_times[model_to_use][-100:]
+            self._record_request(model_to_use, response.processing_time_ms)
             
-            logger.info(f"Generated response using {model_to_use} in {response.processing_time_ms:.2f}ms")
+            logger.debug("Generated response using %s in %.2fms", model_to_use, response.processing_time_ms)
             return response
             
         except Exception as e:
             logger.error(f"Error generating with model {model_to_use}: {e}")
             
+            # Only backend failures count against the model; errors caused by the
+            # request itself (e.g. prompt too long for its context) still try fallbacks
+            if _is_provider_failure(e):
+                self._record_failure(model_to_use)
+                        
             # Try fallback models
             fallback_models = request.fallback_models or []
             for fallback_model in fallback_models:
@@ -181,28 +398,28 @@ class ModelManager:
                     self.health_status.get(fallback_model, False)):
                     
                     try:
-                        logger.info(f"Trying fallback model: {fallback_model}")
-                        model_config = self.models[fallback_model]
-                        provider = self.providers.get(model_config.model_type.value)
+                        logger.info("Trying fallback model: %s", fallback_model)
+                        provider = self._model_providers.get(fallback_model)
                         
                         if provider:
                             response = await provider.generate(fallback_model, request)
                             response.request_id = request_id
                             response.model_used = fallback_model
-                            response.processing_time_ms = (time.time() - start_time) * 1000
-                            response.estimated_cost = await self._calculate_cost(
+                            response.processing_time_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+                            response.estimated_cost = self._calculate_cost(
                                 fallback_model, response.token_usage
                             )
                             
                             # Update statistics
-                            self.request_counts[fallback_model] += 1
-                            self.response_times[fallback_model].append(response.processing_time_ms)
+                            self._record_request(fallback_model, response.processing_time_ms)
                             
-                            logger.info(f"Successfully used fallback model {fallback_model}")
+                            logger.info("Successfully used fallback model %s", fallback_model)
                             return response
                             
                     except Exception as fallback_error:
                         logger.error(f"Fallback model {fallback_model} also failed: {fallback_error}")
+                        if _is_provider_failure(fallback_error):
+                            self._record_failure(fallback_model)
                         continue
             
             # If all models failed
@@ -216,7 +433,7 @@ class ModelManager:
             raise Exception("No available models for this request")
         
         model_config = self.models[model_to_use]
-        provider = self.providers.get(model_config.model_type.value)
+        provider = self._model_providers.get(model_to_use)
         
         if not provider:
             raise Exception(f"Provider not available for model {model_to_use}")
@@ -224,12 +441,9 @@ class ModelManager:
         if not model_config.supports_streaming:
             raise Exception(f"Model {model_to_use} does not support streaming")
         
-        # Stream response
-        chunk_id = 0
+        # Stream response; providers number their own chunks
         async for chunk in provider.generate_stream(model_to_use, request):
-            chunk.chunk_id = chunk_id
             yield chunk
-            chunk_id += 1
     
     async def _select_best_model(self, request: AIRequest) -> Optional[str]:
         """Select the best model for a request based on various factors"""
@@ -240,63 +454,122 @@ class ModelManager:
                 self.health_status.get(request.preferred_model, False)):
                 return request.preferred_model
         
-        # Otherwise, select based on criteria
-        available_models = [
-            model_id for model_id, model_config in self.models.items()
-            if self.health_status.get(model_id, False) and model_config.is_active
-        ]
-        
-        if not available_models:
-            return None
-        
-        # Score models based on various factors
-        model_scores = {}
-        for model_id in available_models:
-            model_config = self.models[model_id]
-            score = 0
+        # Otherwise, walk the ranking from the top. Only the capability bonus
+        # depends on the request, so stop once no lower-ranked model could
+        # overtake the best one found even with the bonus.
+        best_model, best_score = None, float("-inf")
+        for base_score, model_id in reversed(self._ranked_models):
+            if base_score + CAPABILITY_BONUS <= best_score:
+                break
             
-            # Health score (0-100)
-            if self.health_status.get(model_id, False):
-                score += 50
+            model_config = self.models.get(model_id)
+            if not model_config or not self.health_status.get(model_id, False):
+                continue  # Changed since the ranking was last rebuilt
             
-            # Response time score (lower is better)
-            avg_response_time = self._get_average_response_time(model_id)
-            if avg_response_time > 0:
-                # Invert and normalize (faster models get higher scores)
-                score += max(0, 50 - (avg_response_time / 100))
-            else:
-                score += 25  # Default score for new models
+            score = base_score
+            if request.max_tokens and request.max_tokens <= model_config.max_tokens:
+                score += CAPABILITY_BONUS
             
-            # Cost efficiency score (lower cost is better for similar quality)
-            cost_score = self._get_cost_efficiency_score(model_id)
-            score += cost_score
+            if score > best_score:
+                best_model, best_score = model_id, score
+        
+        if best_model is None:
+            best_model, best_score = self._scan_best_model(request)
+            if best_model is None:
+                return None
+                
+        logger.debug("Selected model %s with score %s", best_model, best_score)
+        
+        return best_model
+    
+    def _scan_best_model(self, request: AIRequest) -> Tuple[Optional[str], float]:
+        """Score every selectable model in one pass; used when the ranking is stale"""
+        best_model, best_score = None, float("-inf")
+        for model_id, model_config in self.models.items():
+            if not (model_config.is_active and self.health_status.get(model_id, False)):
+                continue
             
-            # Capability matching
+            score = self._base_score(model_id)
             if request.max_tokens and request.max_tokens <= model_config.max_tokens:
-                score += 20
-            
-            # Model type preferences (can be customized)
-            if model_config.model_type == ModelType.ANTHROPIC:
-                score += 10  # Slight preference for Anthropic
-            elif model_config.model_type == ModelType.OPENAI:
-                score += 8
-            elif model_config.model_type == ModelType.OLLAMA:
-                score += 15  # Prefer local models for cost
+                score += CAPABILITY_BONUS
             
-            model_scores[model_id] = score
+            if score > best_score:
+                best_model, best_score = model_id, score
         
-        # Return the highest scoring model
-        best_model = max(model_scores.items(), key=lambda x: x[1])[0]
-        logger.info(f"Selected model {best_model} with score {model_scores[best_model]}")
+        return best_model, best_score
+    
+    def _base_score(self, model_id: str) -> float:
+        """Score a model on everything except request-specific capability"""
+        model_config = self.models[model_id]
         
-        return best_model
+        # Health score (only healthy models are ranked)
+        score = 50
+        
+        # Response time score (lower is better)
+        avg_response_time = self._get_average_response_time(model_id)
+        if avg_response_time > 0:
+            # Invert and normalize (faster models get higher scores)
+            score += max(0, 50 - (avg_response_time / 100))
+        else:
+            score += 25  # Default score for new models
+        
+        # Cost efficiency score (lower cost is better for similar quality)
+        score += self._get_cost_efficiency_score(model_id)
+        
+        # Model type preferences
+        score += MODEL_TYPE_PREFERENCE.get(model_config.model_type, 0)
+        
+        return score
+    
+    def _rank_models(self):
+        """Rebuild the ranking of healthy, active models"""
+        self._model_scores = {
+            model_id: self._base_score(model_id)
+            for model_id, model_config in self.models.items()
+            if self.health_status.get(model_id, False) and model_config.is_active
+        }
+        self._ranked_models = sorted(
+            (score, model_id) for model_id, score in self._model_scores.items()
+        )
+    
+    def _rerank_model(self, model_id: str):
+        """Move a single model to its new place in the ranking"""
+        old_score = self._model_scores.pop(model_id, None)
+        if old_score is not None:
+            self._ranked_models.remove((old_score, model_id))
+        
+        model_config = self.models.get(model_id)
+        if model_config and model_config.is_active and self.health_status.get(model_id, False):
+            score = self._base_score(model_id)
+            self._model_scores[model_id] = score
+            bisect.insort(self._ranked_models, (score, model_id))
+    
+    def _record_request(self, model_id: str, response_time_ms: float):
+        """Count a completed request and add its time to the model's window"""
+        # No awaits here, so this cannot interleave with a reload or health sweep
+        self.request_counts[model_id] += 1
+        self._record_success(model_id)
+        
+        # A reload may have dropped the model while its request was in flight
+        response_times = self.response_times.get(model_id)
+        if response_times is None or model_id not in self.models:
+            return
+        
+        # A full deque drops its oldest entry on append; take it out of the sum
+        if len(response_times) == response_times.maxlen:
+            self._rt_sum[model_id] -= response_times[0]
+        
+        response_times.append(response_time_ms)
+        self._rt_sum[model_id] += response_time_ms
+        
+        self._rerank_model(model_id)
     
     def _get_average_response_time(self, model_id: str) -> float:
         """Get average response time for a model"""
-        response_times = self.response_times.get(model_id, [])
+        response_times = self.response_times.get(model_id)
         if not response_times:
             return 0
-        return sum(response_times) / len(response_times)
+        return self._rt_sum[model_id] / len(response_times)
     
     def _get_cost_efficiency_score(self, model_id: str) -> float:
         """Get cost efficiency score for a model (0-30 points)"""
@@ -306,33 +579,27 @@ class ModelManager:
         
         # Simple cost scoring - lower cost gets higher score
         pricing = model_config.pricing
-        if pricing.pricing_model == PricingModel.FREE:
+        if pricing.pricing_model is PricingModel.FREE:
             return 30
-        elif pricing.pricing_model == PricingModel.PER_TOKEN:
+        elif pricing.pricing_model is PricingModel.PER_TOKEN:
             # Normalize token costs (assuming typical range 0.0001 to 0.01 per token)
             avg_cost = (pricing.input_token_cost + pricing.output_token_cost) / 2
             return max(0, 30 - (avg_cost * 3000))  # Scale factor
         else:
             return 15  # Default score for other pricing models
     
-    async def _calculate_cost(self, model_id: str, token_usage: TokenUsage) -> float:
+    def _calculate_cost(self, model_id: str, token_usage: TokenUsage) -> float:
         """Calculate cost for token usage"""
-        model_config = self.models.get(model_id)
-        if not model_config:
+        rates = self._pricing_flat.get(model_id)
+        if not rates:
             return 0.0
         
-        pricing = model_config.pricing
-        
-        if pricing.pricing_model == PricingModel.FREE:
-            return 0.0
-        elif pricing.pricing_model == PricingModel.PER_TOKEN:
-            input_cost = token_usage.input_tokens * pricing.input_token_cost
-            output_cost = token_usage.output_tokens * pricing.output_token_cost
-            return input_cost + output_cost
-        elif pricing.pricing_model == PricingModel.PER_REQUEST:
-            return pricing.request_cost
-        else:
-            return 0.0
+        input_rate, output_rate, flat_cost = rates
+        return (
+            token_usage.input_tokens * input_rate
+            + token_usage.output_tokens * output_rate
+            + flat_cost
+        )
     
     async def configure_model(self, model_id: str, config: Dict[str, Any]) -> Dict[str, Any]:
         """Configure model-specific settings"""
@@ -340,20 +607,30 @@ class ModelManager:
             raise ValueError(f"Model {model_id} not found")
         
         model_config = self.models[model_id]
-        provider = self.providers.get(model_config.model_type.value)
+        provider = self._model_providers.get(model_id)
         
         if not provider:
             raise ValueError(f"Provider not available for model {model_id}")
         
-        # Update configuration
-        result = await provider.configure_model(model_id, config)
-        
-        # Update model config if needed
-        if "is_active" in config:
-            model_config.is_active = config["is_active"]
+        async with self._lock:
+            # Update configuration
+            result = await provider.configure_model(model_id, config)
+            
+            # Update model config if needed
+            if "is_active" in config:
+                model_config.is_active = config["is_active"]
+                self._rerank_model(model_id)
+                self._render_models()
         
         return result
     
+    def get_pull_status(self, model_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Progress of a background model pull, for providers that pull models"""
+        provider = self._model_providers.get(model_id)
+        if not provider or not hasattr(provider, "get_pull_status"):
+            return None
+        return provider.get_pull_status(job_id)
+    
     async def reload_models(self):
         """Reload all model configurations"""
         logger.info("Reloading all model configurations...")
@@ -382,4 +659,20 @@ class ModelManager:
                 model_id: self._get_average_response_time(model_id)
                 for model_id in self.models.keys()
             }
-        }
\ No newline at end of file
+        }
+    
+    async def close(self):
+        """Close providers and the shared HTTP client"""
+        for task in list(self._probe_tasks.values()):
+            task.cancel()
+        
+        for provider_name, provider in self.providers.items():
+            if hasattr(provider, "close"):
+                try:
+                    await provider.close()
+                except Exception as e:
+                    logger.warning(f"Error closing {provider_name} provider: {e}")
+        
+        if self.http:
+            await self.http.aclose()
+            self.http = None
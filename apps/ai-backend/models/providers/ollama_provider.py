@@ -3,162 +3,264 @@ Ollama Provider - Handles local open-source models via Ollama
 """
 
 import asyncio
+import functools
+import hashlib
 import logging
-from typing import Dict, List, Optional, Any, AsyncGenerator
+from typing import Dict, List, Optional, Any, AsyncGenerator, Tuple
 import aiohttp
-import json
+import orjson
 import time
 import os
-from datetime import datetime
+import uuid
+from datetime import datetime, timezone
+from types import MappingProxyType
 
 from schemas.ai_schemas import (
     AIRequest, AIResponse, ModelConfig, ModelType, 
     TokenUsage, StreamChunk, ModelPricing, PricingModel
 )
+from utils.cache import TTLCache
 from utils.logger import setup_logger
+from utils.tokens import count_tokens
 
 logger = setup_logger(__name__)
 
+# Completed responses reused for identical generation requests
+RESPONSE_CACHE_TTL = 600
+RESPONSE_CACHE_SIZE = 1024
+
+# Seconds a fetched /api/tags listing is reused
+TAGS_CACHE_TTL = 30
+
+# Background model pull jobs remembered for status queries
+PULL_JOB_HISTORY = 256
+PULL_JOB_TTL = 3600
+
+# Display configurations for common open-source models, keyed by base name
+_MODEL_CONFIGS = MappingProxyType({
+    "llama2": {
+        "name": "Llama 2",
+        "description": "Meta's Llama 2 model - excellent for general tasks",
+        "max_tokens": 4096,
+        "supports_streaming": True
+    },
+    "llama2:13b": {
+        "name": "Llama 2 13B",
+        "description": "Larger Llama 2 model with better performance",
+        "max_tokens": 4096,
+        "supports_streaming": True
+    },
+    "llama2:70b": {
+        "name": "Llama 2 70B",
+        "description": "Largest Llama 2 model for complex tasks",
+        "max_tokens": 4096,
+        "supports_streaming": True
+    },
+    "mistral": {
+        "name": "Mistral 7B",
+        "description": "Mistral 7B model - fast and efficient",
+        "max_tokens": 8192,
+        "supports_streaming": True
+    },
+    "mixtral": {
+        "name": "Mixtral 8x7B",
+        "description": "Mixtral mixture of experts model",
+        "max_tokens": 32768,
+        "supports_streaming": True
+    },
+    "codellama": {
+        "name": "Code Llama",
+        "description": "Specialized model for code generation",
+        "max_tokens": 4096,
+        "supports_streaming": True
+    },
+    "phi": {
+        "name": "Phi-2",
+        "description": "Microsoft Phi-2 small but capable model",
+        "max_tokens": 2048,
+        "supports_streaming": True
+    },
+    "gemma": {
+        "name": "Gemma",
+        "description": "Google's Gemma lightweight model",
+        "max_tokens": 8192,
+        "supports_streaming": True
+    },
+    "neural-chat": {
+        "name": "Neural Chat",
+        "description": "Intel's Neural Chat model optimized for conversations",
+        "max_tokens": 4096,
+        "supports_streaming": True
+    }
+})
+
+# Extra instruction per channel a reply is written for
+_MSG_TYPE_INSTRUCTIONS = MappingProxyType({
+    "whatsapp": "Keep responses concise and suitable for WhatsApp messaging.",
+    "email": "Format response as professional email content.",
+})
+
+@functools.lru_cache(maxsize=512)
+def _system_prefix(has_lead: bool, language: Optional[str],
+                   message_type: Optional[str], tone: Optional[str]) -> str:
+    """'System: ...' line for a request context, or "" when it adds nothing"""
+    context_parts = []
+    if has_lead:
+        context_parts.append("You are an AI assistant helping with CRM lead management.")
+    if language:
+        context_parts.append(f"Respond in {language} language.")
+    if message_type in _MSG_TYPE_INSTRUCTIONS:
+        context_parts.append(_MSG_TYPE_INSTRUCTIONS[message_type])
+    if tone:
+        context_parts.append(f"Use a {tone} tone in your response.")
+    
+    return "System: " + " ".join(context_parts) if context_parts else ""
+
+# Generation bodies are posted as pre-encoded orjson bytes
+_JSON_HEADERS = {"Content-Type": "application/json"}
+_STREAM_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
+
+def _json_dumps(obj: Any) -> str:
+    """aiohttp request-body serializer backed by orjson"""
+    return orjson.dumps(obj).decode()
+
 class OllamaProvider:
     """Provider for Ollama local models"""
     
     def __init__(self):
         self.base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        self.max_parallel = int(os.getenv("OLLAMA_MAX_PARALLEL", "16"))
+        # How long Ollama keeps a model loaded after a request (per-model overrides via configure_model)
+        self._keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+        # No ceiling on generation length; fail only when the socket stalls
+        self._gen_timeout = aiohttp.ClientTimeout(
+            connect=5,
+            sock_connect=5,
+            sock_read=int(os.getenv("OLLAMA_SOCK_READ", "90"))
+        )
+        self._model_keep_alive: Dict[str, str] = {}
         self.available_models = {}
         self.session = None
+        self._gen_sem: Optional[asyncio.Semaphore] = None
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._tags: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._tags_cache: Optional[Tuple[float, List[ModelConfig]]] = None
+        self._pull_tasks: Dict[str, asyncio.Task] = {}
+        self._pull_progress = TTLCache(maxsize=PULL_JOB_HISTORY, ttl=PULL_JOB_TTL)
         
     async def initialize(self):
         """Initialize Ollama provider"""
-        self.session = aiohttp.ClientSession()
+        # One keep-alive pool to the Ollama host, sized to the parallel requests we issue
+        connector = aiohttp.TCPConnector(
+            limit=self.max_parallel,
+            limit_per_host=self.max_parallel,
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True
+        )
+        self.session = aiohttp.ClientSession(
+            base_url=self.base_url,
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None),
+            json_serialize=_json_dumps,
+            # Hand NDJSON stream reads over as soon as a line or two has arrived
+            read_bufsize=8192
+        )
         
-        # Test connection to Ollama
+        # Match the server's parallel request slots (OLLAMA_NUM_PARALLEL on the Ollama host)
+        self._gen_sem = asyncio.Semaphore(int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+                
+        # Test connection to Ollama; the listing is cached for the manager's model load
         try:
-            async with self.session.get(f"{self.base_url}/api/tags") as response:
-                if response.status == 200:
-                    models_data = await response.json()
-                    logger.info(f"Ollama provider initialized with {len(models_data.get('models', []))} models")
-                else:
-                    raise Exception(f"Ollama API returned status {response.status}")
+            models = await self.get_available_models()
+            logger.info(f"Ollama provider initialized with {len(models)} models")
         except Exception as e:
             logger.error(f"Failed to initialize Ollama provider: {e}")
             raise
+        
+        # Load configured models up front so the first request doesn't pay the cold start
+        warm_models = [m.strip() for m in os.getenv("OLLAMA_WARM_MODELS", "").split(",") if m.strip()]
+        if warm_models:
+            await asyncio.gather(*(self._warm(m) for m in warm_models), return_exceptions=True)
     
-    async def get_available_models(self) -> List[ModelConfig]:
-        """Get list of available Ollama models"""
+    async def _warm(self, model_id: str):
+        """Ask Ollama to load a model into memory with a one-token generation"""
+        payload = {
+            "model": model_id,
+            "prompt": "",
+            "stream": False,
+            "keep_alive": "30m",
+            "options": {"num_predict": 1}
+        }
+        try:
+            async with self.session.post("/api/generate", json=payload) as response:
+                if response.status == 200:
+                    logger.info(f"Warmed Ollama model {model_id}")
+                else:
+                    logger.warning(f"Warming Ollama model {model_id} returned status {response.status}")
+        except Exception as e:
+            logger.warning(f"Failed to warm Ollama model {model_id}: {e}")
+    
+    async def get_available_models(self, force_refresh: bool = False) -> List[ModelConfig]:
+        """Get list of available Ollama models, reusing a list younger than TAGS_CACHE_TTL"""
         if not self.session:
             raise RuntimeError("Provider not initialized")
         
+        if (not force_refresh and self._tags_cache
+                and time.monotonic() - self._tags_cache[0] < TAGS_CACHE_TTL):
+            return self._tags_cache[1]
+        
         try:
-            async with self.session.get(f"{self.base_url}/api/tags") as response:
-                if response.status != 200:
-                    raise Exception(f"Ollama API returned status {response.status}")
+            data = await self._get_tags(force_refresh=force_refresh)
+            models = []
+            
+            for model_data in data.get("models", []):
+                model_name = model_data.get("name", "")
+                base_name = model_name.split(":")[0]  # Remove tag
                 
-                data = await response.json()
-                models = []
+                # Use base name to find config, fallback to model name
+                config = _MODEL_CONFIGS.get(base_name) or _MODEL_CONFIGS.get(model_name)
                 
-                # Define configurations for common open-source models
-                model_configs = {
-                    "llama2": {
-                        "name": "Llama 2",
-                        "description": "Meta's Llama 2 model - excellent for general tasks",
-                        "max_tokens": 4096,
-                        "supports_streaming": True
-                    },
-                    "llama2:13b": {
-                        "name": "Llama 2 13B",
-                        "description": "Larger Llama 2 model with better performance",
-                        "max_tokens": 4096,
-                        "supports_streaming": True
-                    },
-                    "llama2:70b": {
-                        "name": "Llama 2 70B",
-                        "description": "Largest Llama 2 model for complex tasks",
-                        "max_tokens": 4096,
-                        "supports_streaming": True
-                    },
-                    "mistral": {
-                        "name": "Mistral 7B",
-                        "description": "Mistral 7B model - fast and efficient",
-                        "max_tokens": 8192,
-                        "supports_streaming": True
-                    },
-                    "mixtral": {
-                        "name": "Mixtral 8x7B",
-                        "description": "Mixtral mixture of experts model",
-                        "max_tokens": 32768,
-                        "supports_streaming": True
-                    },
-                    "codellama": {
-                        "name": "Code Llama",
-                        "description": "Specialized model for code generation",
-                        "max_tokens": 4096,
-                        "supports_streaming": True
-                    },
-                    "phi": {
-                        "name": "Phi-2",
-                        "description": "Microsoft Phi-2 small but capable model",
-                        "max_tokens": 2048,
-                        "supports_streaming": True
-                    },
-                    "gemma": {
-                        "name": "Gemma",
-                        "description": "Google's Gemma lightweight model",
-                        "max_tokens": 8192,
-                        "supports_streaming": True
-                    },
-                    "neural-chat": {
-                        "name": "Neural Chat",
-                        "description": "Intel's Neural Chat model optimized for conversations",
+                if not config:
+                    # Create default config for unknown models
+                    config = {
+                        "name": model_name.title(),
+                        "description": f"Open source model: {model_name}",
                         "max_tokens": 4096,
                         "supports_streaming": True
                     }
-                }
                 
-                for model_data in data.get("models", []):
-                    model_name = model_data.get("name", "")
-                    base_name = model_name.split(":")[0]  # Remove tag
-                    
-                    # Use base name to find config, fallback to model name
-                    config = model_configs.get(base_name) or model_configs.get(model_name)
-                    
-                    if not config:
-                        # Create default config for unknown models
-                        config = {
-                            "name": model_name.title(),
-                            "description": f"Open source model: {model_name}",
-                            "max_tokens": 4096,
-                            "supports_streaming": True
-                        }
-                    
-                    # All Ollama models are free (local execution)
-                    pricing = ModelPricing(
-                        model_id=model_name,
-                        pricing_model=PricingModel.FREE,
-                        input_token_cost=0.0,
-                        output_token_cost=0.0,
-                        currency="USD"
-                    )
-                    
-                    model_config = ModelConfig(
-                        model_id=model_name,
-                        model_type=ModelType.OLLAMA,
-                        name=config["name"],
-                        description=config["description"],
-                        max_tokens=config["max_tokens"],
-                        supports_streaming=config["supports_streaming"],
-                        supports_functions=False,  # Most open source models don't support function calling
-                        supports_vision=False,    # Add vision support detection later
-                        pricing=pricing,
-                        is_active=True,
-                        health_status="healthy"
-                    )
-                    
-                    models.append(model_config)
-                    self.available_models[model_name] = model_config
+                # All Ollama models are free (local execution)
+                pricing = ModelPricing(
+                    model_id=model_name,
+                    pricing_model=PricingModel.FREE,
+                    input_token_cost=0.0,
+                    output_token_cost=0.0,
+                    currency="USD"
+                )
                 
-                logger.info(f"Loaded {len(models)} Ollama model configurations")
-                return models
+                model_config = ModelConfig(
+                    model_id=model_name,
+                    model_type=ModelType.OLLAMA,
+                    name=config["name"],
+                    description=config["description"],
+                    max_tokens=config["max_tokens"],
+                    supports_streaming=config["supports_streaming"],
+                    supports_functions=False,  # Most open source models don't support function calling
+                    supports_vision=False,    # Add vision support detection later
+                    pricing=pricing,
+                    is_active=True,
+                    health_status="healthy"
+                )
                 
+                models.append(model_config)
+                self.available_models[model_name] = model_config
+            
+            self._tags_cache = (time.monotonic(), models)
+            logger.info(f"Loaded {len(models)} Ollama model configurations")
+            return models
+            
         except Exception as e:
             logger.error(f"Error fetching Ollama models: {e}")
             raise
@@ -171,46 +273,84 @@ class OllamaProvider:
         if model_id not in self.available_models:
             raise ValueError(f"Model {model_id} not available")
         
+        # Build prompt with context
+        prompt = self._build_prompt(request)
+        
+        if not request.cache_response or (request.context or {}).get("no_cache"):
+            return await self._generate(model_id, request, prompt)
+        
+        key = hashlib.blake2b(
+            f"{model_id}|{prompt}|{request.temperature}|{request.top_p}|"
+            f"{request.top_k}|{request.max_tokens}".encode(),
+            digest_size=16
+        ).hexdigest()
+        
+        cached = self._response_cache.get(key)
+        if cached is not None:
+            return cached.model_copy(deep=True)
+        
+        # Identical requests share one upstream call. It runs in its own task so
+        # a caller that disconnects only stops waiting; the others still get the result
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate_cached(key, model_id, request, prompt))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._inflight_done, key))
+        
+        # Callers mutate the returned response, so each gets its own copy
+        return (await asyncio.shield(task)).model_copy(deep=True)
+    
+    async def _generate_cached(
+        self,
+        key: str,
+        model_id: str,
+        request: AIRequest,
+        prompt: str
+    ) -> AIResponse:
+        """Run a shared generation and cache its response"""
+        response = await self._generate(model_id, request, prompt)
+        self._response_cache.set(key, response)
+        return response
+    
+    def _inflight_done(self, key: str, task: asyncio.Task):
+        """Forget a finished shared generation"""
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # Mark retrieved when every caller stopped waiting
+    
+    async def _generate(self, model_id: str, request: AIRequest, prompt: str) -> AIResponse:
+        """Call /api/generate for a prompt"""
         try:
-            # Build prompt with context
-            prompt = self._build_prompt(request)
-            
             # Prepare request payload
-            payload = {
-                "model": model_id,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": request.temperature or 0.7,
-                    "top_p": request.top_p or 1.0,
-                    "num_predict": request.max_tokens or 1000,
-                }
-            }
-            
-            if request.top_k:
-                payload["options"]["top_k"] = request.top_k
+            payload = self._build_payload(model_id, request, prompt, stream=False)
             
             # Make API call
-            start_time = time.time()
+            start_ns = time.perf_counter_ns()
             
             async with self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=120)  # 2 minutes timeout
+                "/api/generate",
+                data=orjson.dumps(payload),
+                headers=_JSON_HEADERS,
+                timeout=self._gen_timeout
             ) as response:
                 if response.status != 200:
                     error_text = await response.text()
-                    raise Exception(f"Ollama API error {response.status}: {error_text}")
+                    raise aiohttp.ClientResponseError(
+                        response.request_info,
+                        response.history,
+                        status=response.status,
+                        message=f"Ollama API error {response.status}: {error_text}"
+                    )
                 
-                result = await response.json()
-                processing_time = (time.time() - start_time) * 1000
+                result = await response.json(loads=orjson.loads)
+                processing_time = (time.perf_counter_ns() - start_ns) / 1_000_000
                 
                 # Extract response content
                 content = result.get("response", "")
                 
                 # Estimate token usage (Ollama doesn't provide exact counts)
-                input_tokens = self._estimate_tokens(prompt)
-                output_tokens = self._estimate_tokens(content)
+                input_tokens = self._estimate_tokens(prompt, model_id)
+                output_tokens = self._estimate_tokens(content, model_id)
                 
                 token_usage = TokenUsage(
                     input_tokens=input_tokens,
@@ -234,6 +374,28 @@ class OllamaProvider:
             logger.error(f"Error generating with Ollama model {model_id}: {e}")
             raise
     
+    async def generate_batch(
+        self,
+        model_id: str,
+        requests: List[AIRequest]
+    ) -> List[Any]:
+        """Generate responses for several requests concurrently.
+        
+        Returns one entry per request, in order: an AIResponse, or the
+        exception that request raised.
+        """
+        if not self._gen_sem:
+            raise RuntimeError("Provider not initialized")
+        
+        async def _one(request: AIRequest) -> AIResponse:
+            async with self._gen_sem:
+                return await self.generate(model_id, request)
+        
+        return await asyncio.gather(
+            *(_one(request) for request in requests),
+            return_exceptions=True
+        )
+    
     async def generate_stream(self, model_id: str, request: AIRequest) -> AsyncGenerator[StreamChunk, None]:
         """Generate streaming response using Ollama model"""
         if not self.session:
@@ -247,63 +409,51 @@ class OllamaProvider:
             prompt = self._build_prompt(request)
             
             # Prepare request payload
-            payload = {
-                "model": model_id,
-                "prompt": prompt,
-                "stream": True,
-                "options": {
-                    "temperature": request.temperature or 0.7,
-                    "top_p": request.top_p or 1.0,
-                    "num_predict": request.max_tokens or 1000,
-                }
-            }
-            
-            if request.top_k:
-                payload["options"]["top_k"] = request.top_k
+            payload = self._build_payload(model_id, request, prompt, stream=True)
             
             # Stream response
             chunk_id = 0
-            total_content = ""
+            total_tokens = 0
             
             async with self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=300)  # 5 minutes for streaming
+                "/api/generate",
+                data=orjson.dumps(payload),
+                # Small token lines gain nothing from gzip and decompression delays the first token
+                headers=_STREAM_HEADERS,
+                timeout=self._gen_timeout
             ) as response:
                 if response.status != 200:
                     error_text = await response.text()
-                    raise Exception(f"Ollama API error {response.status}: {error_text}")
+                    raise aiohttp.ClientResponseError(
+                        response.request_info,
+                        response.history,
+                        status=response.status,
+                        message=f"Ollama API error {response.status}: {error_text}"
+                    )
                 
-                async for line in response.content:
-                    if line:
-                        try:
-                            chunk_data = json.loads(line.decode('utf-8'))
-                            
-                            if "response" in chunk_data:
-                                content = chunk_data["response"]
-                                total_content += content
-                                
-                                stream_chunk = StreamChunk(
-                                    chunk_id=chunk_id,
-                                    content=content,
-                                    is_final=chunk_data.get("done", False)
-                                )
-                                yield stream_chunk
-                                chunk_id += 1
-                                
-                                if chunk_data.get("done", False):
-                                    break
-                                    
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"Failed to parse chunk: {e}")
-                            continue
+                async for chunk_data in self._iter_ndjson(response):
+                    if "response" in chunk_data:
+                        content = chunk_data["response"]
+                        # Chunks are a token or two; repeated pieces hit the count cache
+                        total_tokens += self._estimate_tokens(content, model_id)
+                        
+                        stream_chunk = StreamChunk(
+                            chunk_id=chunk_id,
+                            content=content,
+                            is_final=chunk_data.get("done", False)
+                        )
+                        yield stream_chunk
+                        chunk_id += 1
+                        
+                        if chunk_data.get("done", False):
+                            break
             
             # Send final chunk with metadata
             final_chunk = StreamChunk(
                 chunk_id=chunk_id,
                 content="",
                 is_final=True,
-                total_tokens=self._estimate_tokens(total_content),
+                total_tokens=total_tokens,
                 model_used=model_id
             )
             yield final_chunk
@@ -318,18 +468,11 @@ class OllamaProvider:
             return False
         
         try:
-            # Test with a simple generation
-            payload = {
-                "model": model_id,
-                "prompt": "Hello",
-                "stream": False,
-                "options": {"num_predict": 5}
-            }
-            
+            # Metadata lookup only: doesn't run the model or take a generation slot
             async with self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=30)
+                "/api/show",
+                json={"name": model_id},
+                timeout=aiohttp.ClientTimeout(total=5)
             ) as response:
                 return response.status == 200
                 
@@ -351,49 +494,73 @@ class OllamaProvider:
             model_config.is_active = config["is_active"]
             result["updated_settings"]["is_active"] = config["is_active"]
         
-        # Ollama models can be pulled/removed
+        if "keep_alive" in config:
+            self._model_keep_alive[model_id] = config["keep_alive"]
+            result["updated_settings"]["keep_alive"] = config["keep_alive"]
+        
+        # Ollama models can be pulled/removed; pulls run in the background (see get_pull_status)
         if "pull_model" in config and config["pull_model"]:
-            try:
-                async with self.session.post(
-                    f"{self.base_url}/api/pull",
-                    json={"name": model_id}
-                ) as response:
-                    if response.status == 200:
-                        result["updated_settings"]["pulled"] = True
-                    else:
-                        result["updated_settings"]["pull_error"] = f"Status {response.status}"
-            except Exception as e:
-                result["updated_settings"]["pull_error"] = str(e)
+            job_id = f"pull_{uuid.uuid4().hex[:12]}"
+            self._pull_progress.set(job_id, {"model_id": model_id, "status": "queued"})
+            self._pull_tasks[job_id] = asyncio.create_task(self._pull_model(job_id, model_id))
+            result["updated_settings"]["pull_job_id"] = job_id
         
         return result
     
+    def get_pull_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Progress of a background model pull, or None for an unknown/expired job"""
+        progress = self._pull_progress.get(job_id)
+        return dict(progress) if progress is not None else None
+    
+    async def _pull_model(self, job_id: str, model_id: str):
+        """Stream /api/pull, recording its progress under job_id"""
+        progress = self._pull_progress.get(job_id) or {"model_id": model_id}
+        try:
+            async with self.session.post("/api/pull", json={"name": model_id}) as response:
+                if response.status != 200:
+                    raise Exception(f"Ollama API returned status {response.status}")
+                
+                async for update in self._iter_ndjson(response):
+                    if "error" in update:
+                        raise Exception(update["error"])
+                    progress["status"] = update.get("status", progress.get("status"))
+                    if "total" in update:
+                        progress["total"] = update["total"]
+                        progress["completed"] = update.get("completed", 0)
+            
+            progress["status"] = "success"
+            # New layers change what /api/tags reports
+            self._tags = None
+            self._tags_cache = None
+            logger.info(f"Pulled Ollama model {model_id}")
+        
+        except asyncio.CancelledError:
+            progress["status"] = "cancelled"
+            raise
+        except Exception as e:
+            progress["status"] = "error"
+            progress["error"] = str(e)
+            logger.error(f"Error pulling Ollama model {model_id}: {e}")
+        finally:
+            self._pull_progress.set(job_id, progress)
+            self._pull_tasks.pop(job_id, None)
+    
     async def get_status(self) -> Dict[str, Any]:
         """Get provider status"""
         if not self.session:
             return {"status": "not_initialized"}
         
         try:
-            # Test Ollama connectivity
-            async with self.session.get(f"{self.base_url}/api/tags") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return {
-                        "status": "healthy",
-                        "models_available": len(self.available_models),
-                        "ollama_accessible": True,
-                        "base_url": self.base_url,
-                        "loaded_models": len(data.get("models", [])),
-                        "last_check": datetime.utcnow().isoformat()
-                    }
-                else:
-                    return {
-                        "status": "unhealthy",
-                        "error": f"Ollama API returned status {response.status}",
-                        "models_available": len(self.available_models),
-                        "ollama_accessible": False,
-                        "base_url": self.base_url,
-                        "last_check": datetime.utcnow().isoformat()
-                    }
+            # Test Ollama connectivity (at most once per TAGS_CACHE_TTL)
+            data = await self._get_tags()
+            return {
+                "status": "healthy",
+                "models_available": len(self.available_models),
+                "ollama_accessible": True,
+                "base_url": self.base_url,
+                "loaded_models": len(data.get("models", [])),
+                "last_check": datetime.now(timezone.utc).isoformat()
+            }
                     
         except Exception as e:
             return {
@@ -402,53 +569,104 @@ class OllamaProvider:
                 "models_available": len(self.available_models),
                 "ollama_accessible": False,
                 "base_url": self.base_url,
-                "last_check": datetime.utcnow().isoformat()
+                "last_check": datetime.now(timezone.utc).isoformat()
             }
     
-    def _build_prompt(self, request: AIRequest) -> str:
-        """Build prompt with context for Ollama models"""
-        parts = []
+    async def _get_tags(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """Fetch /api/tags, reusing a response younger than TAGS_CACHE_TTL"""
+        if (not force_refresh and self._tags
+                and time.monotonic() - self._tags[0] < TAGS_CACHE_TTL):
+            return self._tags[1]
         
-        # Add context as system instructions
-        if request.context:
-            context_parts = []
-            
-            if request.context.get("lead_id"):
-                context_parts.append("You are an AI assistant helping with CRM lead management.")
-            
-            if request.context.get("language"):
-                context_parts.append(f"Respond in {request.context['language']} language.")
-            
-            if request.context.get("message_type"):
-                message_type = request.context["message_type"]
-                if message_type == "whatsapp":
-                    context_parts.append("Keep responses concise and suitable for WhatsApp messaging.")
-                elif message_type == "email":
-                    context_parts.append("Format response as professional email content.")
+        async with self.session.get("/api/tags") as response:
+            if response.status != 200:
+                raise Exception(f"Ollama API returned status {response.status}")
+            data = await response.json(loads=orjson.loads)
+        
+        self._tags = (time.monotonic(), data)
+        return data
+    
+    async def _iter_ndjson(self, response: aiohttp.ClientResponse) -> AsyncGenerator[Dict[str, Any], None]:
+        """Parse an NDJSON body as it arrives, splitting whole reads rather than single lines"""
+        buf = bytearray()
+        
+        async for data in response.content.iter_any():
+            buf += data
+            end = buf.rfind(b"\n")
+            if end == -1:
+                continue
             
-            if request.context.get("tone"):
-                context_parts.append(f"Use a {request.context['tone']} tone in your response.")
+            # Everything up to the last newline is complete; keep the tail for the next read
+            lines = buf[:end].split(b"\n")
+            del buf[:end + 1]
             
-            if context_parts:
-                parts.append("System: " + " ".join(context_parts))
+            for line in lines:
+                if line:
+                    try:
+                        yield orjson.loads(line)
+                    except orjson.JSONDecodeError as e:
+                        logger.warning(f"Failed to parse chunk: {e}")
         
-        # Add the main prompt
-        parts.append(f"Human: {request.prompt}")
-        parts.append("Assistant:")
+        if buf.strip():
+            try:
+                yield orjson.loads(buf)
+            except orjson.JSONDecodeError as e:
+                logger.warning(f"Failed to parse chunk: {e}")
+    
+    def _build_payload(self, model_id: str, request: AIRequest, prompt: str, stream: bool) -> Dict[str, Any]:
+        """Build the /api/generate request body"""
+        # Explicit None checks so a requested 0.0 (e.g. greedy decoding) is kept
+        options = {
+            "temperature": request.temperature if request.temperature is not None else 0.7,
+            "top_p": request.top_p if request.top_p is not None else 1.0,
+            "num_predict": request.max_tokens if request.max_tokens is not None else 1000,
+        }
+        if request.top_k is not None:
+            options["top_k"] = request.top_k
         
-        return "\n\n".join(parts)
+        return {
+            "model": model_id,
+            "prompt": prompt,
+            "stream": stream,
+            "keep_alive": self._model_keep_alive.get(model_id, self._keep_alive),
+            "options": options
+        }
     
-    def _estimate_tokens(self, text: str) -> int:
-        """Estimate token count (rough approximation)"""
-        if not text:
-            return 0
-        
-        # Very rough estimation: ~4 characters per token for English
-        # This is not accurate but gives a reasonable approximation
-        return max(1, len(text) // 4)
+    def _build_prompt(self, request: AIRequest) -> str:
+        """Build prompt with context for Ollama models"""
+        context = request.context
+        if context:
+            language = context.get("language")
+            message_type = context.get("message_type")
+            tone = context.get("tone")
+            system = _system_prefix(
+                bool(context.get("lead_id")),
+                str(language) if language else None,
+                message_type if isinstance(message_type, str) else None,
+                str(tone) if tone else None,
+            )
+            if system:
+                return f"{system}\n\nHuman: {request.prompt}\n\nAssistant:"
+        
+        return f"Human: {request.prompt}\n\nAssistant:"
+    
+    def _estimate_tokens(self, text: str, model_id: str) -> int:
+        """Estimate token count with a BPE tokenizer (cl100k_base for local models)"""
+        return count_tokens(text, model_id)
     
     async def close(self):
         """Close the provider and cleanup resources"""
+        for task in self._pull_tasks.values():
+            task.cancel()
+        if self._pull_tasks:
+            await asyncio.gather(*self._pull_tasks.values(), return_exceptions=True)
+        
+        inflight = list(self._inflight.values())
+        for task in inflight:
+            task.cancel()
+        if inflight:
+            await asyncio.gather(*inflight, return_exceptions=True)
+        
         if self.session:
             await self.session.close()
             self.session = None
\ No newline at end of file
@@ -3,27 +3,182 @@ OpenAI Provider - Handles OpenAI API models
 """
 
 import asyncio
+import contextlib
+import functools
 import logging
-from typing import Dict, List, Optional, Any, AsyncGenerator
+import re
+from typing import Dict, List, Optional, Any, AsyncGenerator, Tuple
+import httpx
 import openai
+import orjson
 import time
 import os
-from datetime import datetime
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from types import MappingProxyType
 
 from schemas.ai_schemas import (
     AIRequest, AIResponse, ModelConfig, ModelType, 
     TokenUsage, StreamChunk, ModelPricing, PricingModel
 )
+from utils.batch_writer import BatchWriter
 from utils.logger import setup_logger
+from utils.tokens import count_tokens
 
 logger = setup_logger(__name__)
 
+# Model configurations for popular OpenAI models (costs per 1K tokens)
+_MODEL_CONFIGS = MappingProxyType({
+    "gpt-4": {
+        "name": "GPT-4",
+        "description": "Most capable GPT-4 model for complex tasks",
+        "max_tokens": 8192,
+        "context_window": 8192,
+        "supports_streaming": True,
+        "supports_functions": True,
+        "input_cost": 0.03,  # per 1K tokens
+        "output_cost": 0.06
+    },
+    "gpt-4-turbo": {
+        "name": "GPT-4 Turbo",
+        "description": "Latest GPT-4 model with improved efficiency",
+        "max_tokens": 4096,
+        "context_window": 128000,
+        "supports_streaming": True,
+        "supports_functions": True,
+        "supports_vision": True,
+        "input_cost": 0.01,
+        "output_cost": 0.03
+    },
+    "gpt-3.5-turbo": {
+        "name": "GPT-3.5 Turbo",
+        "description": "Fast and efficient model for most tasks",
+        "max_tokens": 4096,
+        "context_window": 16385,
+        "supports_streaming": True,
+        "supports_functions": True,
+        "input_cost": 0.0015,
+        "output_cost": 0.002
+    },
+    "gpt-3.5-turbo-16k": {
+        "name": "GPT-3.5 Turbo 16K",
+        "description": "Extended context version of GPT-3.5 Turbo",
+        "max_tokens": 16385,
+        "context_window": 16385,
+        "supports_streaming": True,
+        "supports_functions": True,
+        "input_cost": 0.003,
+        "output_cost": 0.004
+    }
+})
+
+# Per-token pricing, built once and shared by every listing
+_PRICING_TABLE = MappingProxyType({
+    model_id: ModelPricing(
+        model_id=model_id,
+        pricing_model=PricingModel.PER_TOKEN,
+        input_token_cost=config["input_cost"] / 1000,  # Convert to per token
+        output_token_cost=config["output_cost"] / 1000,
+        currency="USD"
+    )
+    for model_id, config in _MODEL_CONFIGS.items()
+})
+
+# Seconds a fetched model list is reused
+MODELS_CACHE_TTL = 300
+
+# Seconds a healthy probe result is reused, and between billable completion probes
+HEALTH_CACHE_TTL = 30
+HEALTH_COMPLETION_INTERVAL = 600
+
+# Provider status: seconds a successful probe is trusted, and the model looked up to probe
+STATUS_CACHE_TTL = 30
+STATUS_PROBE_MODEL = "gpt-3.5-turbo"
+
+# Requests with context["priority"] == "batch" are pooled into Batch API jobs
+BATCH_MAX_SIZE = int(os.getenv("OPENAI_BATCH_MAX_SIZE", "500"))
+BATCH_MAX_WAIT = int(os.getenv("OPENAI_BATCH_MAX_WAIT_MS", "2000")) / 1000
+BATCH_POLL_INTERVAL = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", "30"))
+BATCH_TERMINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+# Client-side limits for direct completions; match them to the account's tier
+MAX_CONCURRENT = int(os.getenv("OPENAI_MAX_CONCURRENT", "16"))
+RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+RATE_WINDOW = 60.0
+
+# Per-attempt timeout and retry budget for API calls
+REQUEST_TIMEOUT = httpx.Timeout(float(os.getenv("OPENAI_TIMEOUT", "60")), connect=5.0)
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+HEALTH_PROBE_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+STATUS_PROBE_TIMEOUT = httpx.Timeout(2.0)
+
+# Chunks read ahead of a streaming consumer
+STREAM_BUFFER_CHUNKS = 16
+
+# Extra instruction per channel a reply is written for
+_MSG_TYPE_INSTRUCTIONS = MappingProxyType({
+    "whatsapp": "Keep responses concise and suitable for WhatsApp messaging.",
+    "email": "Format response as professional email content.",
+})
+
+@functools.lru_cache(maxsize=256)
+def _system_message(has_lead: bool, language: Optional[str],
+                    message_type: Optional[str], tone: Optional[str]) -> Optional[str]:
+    """System message for a request context shape, or None when it adds nothing"""
+    system_parts = []
+    if has_lead:
+        system_parts.append("You are an AI assistant helping with CRM lead management.")
+    if language:
+        system_parts.append(f"Respond in {language} language.")
+    if message_type in _MSG_TYPE_INSTRUCTIONS:
+        system_parts.append(_MSG_TYPE_INSTRUCTIONS[message_type])
+    if tone:
+        system_parts.append(f"Use a {tone} tone in your response.")
+    
+    return " ".join(system_parts) if system_parts else None
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _parse_reset(value: Optional[str]) -> float:
+    """Seconds in an x-ratelimit-reset-* header such as 20ms, 1s or 6m0s"""
+    if not value:
+        return 0.0
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in _DURATION_PART.findall(value))
+
 class OpenAIProvider:
     """Provider for OpenAI models"""
     
-    def __init__(self):
+    def __init__(self, http: Optional[httpx.AsyncClient] = None):
         self.client = None
+        self._probe_client = None
+        self._status_client = None
+        self._last_healthy_ts = float("-inf")
+        self._last_check: Optional[str] = None
+        self.http = http
         self.available_models = {}
+        self._models_cache: Optional[Tuple[float, List[ModelConfig]]] = None
+        self._models_lock = asyncio.Lock()
+        self._health_cache: Dict[str, Tuple[float, bool]] = {}
+        self._completion_probe_at: Dict[str, float] = {}
+        self._batcher = BatchWriter(
+            "openai-batch",
+            self._submit_batch,
+            batch_size=BATCH_MAX_SIZE,
+            flush_interval=BATCH_MAX_WAIT
+        )
+        self._batch_jobs: Dict[str, asyncio.Task] = {}
+        
+        # Resizable concurrency cap plus sliding 60 s windows of request times and (time, tokens) reservations
+        self._cond = asyncio.Condition()
+        self._in_flight = 0
+        self._cmax = MAX_CONCURRENT
+        self._req_times: deque = deque()
+        self._tok_times: deque = deque()
+        self._tok_sum = 0
+        self._blocked_until = 0.0
         
     async def initialize(self):
         """Initialize OpenAI client"""
@@ -31,81 +186,62 @@ class OpenAIProvider:
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is required")
         
-        self.client = openai.AsyncOpenAI(api_key=api_key)
+        # The SDK retries connection errors, 408/409/429 and 5xx with jittered
+        # exponential backoff (honouring Retry-After), each attempt bounded by the timeout
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=self.http,
+            timeout=REQUEST_TIMEOUT,
+            max_retries=MAX_RETRIES
+        )
+        # Health probes should answer quickly and never queue behind retries
+        self._probe_client = self.client.with_options(timeout=HEALTH_PROBE_TIMEOUT, max_retries=0)
         
-        # Test connection
+        # Status checks only need to know the API answers
+        self._status_client = self.client.with_options(timeout=STATUS_PROBE_TIMEOUT, max_retries=0)
+        
+        # Test connection; the listing is cached for the manager's model load
         try:
-            models = await self.client.models.list()
-            logger.info(f"OpenAI provider initialized with {len(models.data)} models")
+            models = await self.get_available_models()
+            logger.info(f"OpenAI provider initialized with {len(models)} models")
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI provider: {e}")
             raise
+        
+        self._batcher.start()
     
-    async def get_available_models(self) -> List[ModelConfig]:
-        """Get list of available OpenAI models"""
+    async def get_available_models(self, force_refresh: bool = False) -> List[ModelConfig]:
+        """Get list of available OpenAI models, reusing a list younger than MODELS_CACHE_TTL"""
         if not self.client:
             raise RuntimeError("Provider not initialized")
         
+        if not force_refresh and self._models_fresh():
+            return self._models_cache[1]
+        
+        # One models.list() per expiry however many callers arrive at once
+        async with self._models_lock:
+            if not force_refresh and self._models_fresh():
+                return self._models_cache[1]
+            return await self._fetch_models()
+    
+    def _models_fresh(self) -> bool:
+        """Whether the cached model list is still within its TTL"""
+        return bool(self._models_cache) and time.monotonic() - self._models_cache[0] < MODELS_CACHE_TTL
+    
+    async def _fetch_models(self) -> List[ModelConfig]:
+        """List models from the API and build configs for the ones we know"""
         try:
-            models_response = await self.client.models.list()
             models = []
+            remaining = set(_MODEL_CONFIGS)
             
-            # Define model configurations for popular OpenAI models
-            model_configs = {
-                "gpt-4": {
-                    "name": "GPT-4",
-                    "description": "Most capable GPT-4 model for complex tasks",
-                    "max_tokens": 8192,
-                    "supports_streaming": True,
-                    "supports_functions": True,
-                    "input_cost": 0.03,  # per 1K tokens
-                    "output_cost": 0.06
-                },
-                "gpt-4-turbo": {
-                    "name": "GPT-4 Turbo",
-                    "description": "Latest GPT-4 model with improved efficiency",
-                    "max_tokens": 4096,
-                    "supports_streaming": True,
-                    "supports_functions": True,
-                    "supports_vision": True,
-                    "input_cost": 0.01,
-                    "output_cost": 0.03
-                },
-                "gpt-3.5-turbo": {
-                    "name": "GPT-3.5 Turbo",
-                    "description": "Fast and efficient model for most tasks",
-                    "max_tokens": 4096,
-                    "supports_streaming": True,
-                    "supports_functions": True,
-                    "input_cost": 0.0015,
-                    "output_cost": 0.002
-                },
-                "gpt-3.5-turbo-16k": {
-                    "name": "GPT-3.5 Turbo 16K",
-                    "description": "Extended context version of GPT-3.5 Turbo",
-                    "max_tokens": 16385,
-                    "supports_streaming": True,
-                    "supports_functions": True,
-                    "input_cost": 0.003,
-                    "output_cost": 0.004
-                }
-            }
-            
-            for model in models_response.data:
+            # Auto-paginating iterator; stop as soon as every configured model is seen
+            async for model in self.client.models.list():
                 model_id = model.id
                 
                 # Only include models we have configurations for
-                if model_id in model_configs:
-                    config = model_configs[model_id]
-                    
-                    pricing = ModelPricing(
-                        model_id=model_id,
-                        pricing_model=PricingModel.PER_TOKEN,
-                        input_token_cost=config["input_cost"] / 1000,  # Convert to per token
-                        output_token_cost=config["output_cost"] / 1000,
-                        currency="USD"
-                    )
-                    
+                config = _MODEL_CONFIGS.get(model_id)
+                if config and model_id in remaining:
+                    remaining.discard(model_id)
                     model_config = ModelConfig(
                         model_id=model_id,
                         model_type=ModelType.OPENAI,
@@ -115,14 +251,18 @@ class OpenAIProvider:
                         supports_streaming=config["supports_streaming"],
                         supports_functions=config["supports_functions"],
                         supports_vision=config.get("supports_vision", False),
-                        pricing=pricing,
+                        pricing=_PRICING_TABLE[model_id],
                         is_active=True,
                         health_status="healthy"
                     )
                     
                     models.append(model_config)
                     self.available_models[model_id] = model_config
+                    
+                    if not remaining:
+                        break
             
+            self._models_cache = (time.monotonic(), models)
             logger.info(f"Loaded {len(models)} OpenAI model configurations")
             return models
             
@@ -138,45 +278,41 @@ class OpenAIProvider:
         if model_id not in self.available_models:
             raise ValueError(f"Model {model_id} not available")
         
+        if request.context and request.context.get("priority") == "batch":
+            return await self.generate_batched(model_id, request)
+        
         try:
-            # Prepare messages
-            messages = [{"role": "user", "content": request.prompt}]
-            
-            # Add context if provided
-            if request.context:
-                system_message = self._build_system_message(request.context)
-                if system_message:
-                    messages.insert(0, {"role": "system", "content": system_message})
-            
             # Prepare parameters
-            params = {
-                "model": model_id,
-                "messages": messages,
-                "max_tokens": request.max_tokens or 1000,
-                "temperature": request.temperature or 0.7,
-                "top_p": request.top_p or 1.0,
-            }
+            params = self._build_params(model_id, request, stream=False)
             
             # Make API call
-            start_time = time.time()
-            response = await self.client.chat.completions.create(**params)
-            processing_time = (time.time() - start_time) * 1000
+            reserved = self._estimate_request_tokens(model_id, params["messages"], params["max_tokens"])
+            self._check_context_window(model_id, reserved)
+            async with self._admit():
+                await self._throttle(reserved)
+                start_time = time.perf_counter()
+                raw = await self.client.chat.completions.with_raw_response.create(**params)
+                processing_time = (time.perf_counter() - start_time) * 1000
+            
+            response = raw.parse()
+            await self._note_rate_limits(raw.headers)
+            self._settle_tokens(reserved, response.usage.total_tokens if response.usage else reserved)
             
             # Extract response content
             content = ""
             if response.choices and len(response.choices) > 0:
                 content = response.choices[0].message.content or ""
             
-            # Calculate token usage
+            # Calculate token usage (fields come typed from the SDK, so skip validation)
             usage = response.usage
-            token_usage = TokenUsage(
+            token_usage = TokenUsage.model_construct(
                 input_tokens=usage.prompt_tokens if usage else 0,
                 output_tokens=usage.completion_tokens if usage else 0,
                 total_tokens=usage.total_tokens if usage else 0
             )
             
             # Create response
-            ai_response = AIResponse(
+            ai_response = AIResponse.model_construct(
                 content=content,
                 model_used=model_id,
                 request_id="",  # Will be set by model manager
@@ -190,6 +326,119 @@ class OpenAIProvider:
             logger.error(f"Error generating with OpenAI model {model_id}: {e}")
             raise
     
+    async def generate_batched(self, model_id: str, request: AIRequest) -> AIResponse:
+        """Generate through the Batch API: half the price, completes within 24h"""
+        if not self._batcher.running:
+            raise RuntimeError("Provider not initialized")
+        
+        params = self._build_params(model_id, request, stream=False)
+        
+        self._check_context_window(
+            model_id, self._estimate_request_tokens(model_id, params["messages"], params["max_tokens"])
+        )
+        
+        future = asyncio.get_running_loop().create_future()
+        start_time = time.perf_counter()
+        self._batcher.put((f"req_{uuid.uuid4().hex}", params, future))
+        body = await future
+        processing_time = (time.perf_counter() - start_time) * 1000
+        
+        content = ""
+        choices = body.get("choices")
+        if choices:
+            content = (choices[0].get("message") or {}).get("content") or ""
+        
+        usage = body.get("usage") or {}
+        
+        return AIResponse.model_construct(
+            content=content,
+            model_used=model_id,
+            request_id="",  # Will be set by model manager
+            processing_time_ms=processing_time,
+            token_usage=TokenUsage.model_construct(
+                input_tokens=usage.get("prompt_tokens", 0),
+                output_tokens=usage.get("completion_tokens", 0),
+                total_tokens=usage.get("total_tokens", 0)
+            )
+        )
+    
+    async def _submit_batch(self, items: List[Tuple[str, Dict[str, Any], asyncio.Future]]):
+        """Upload pooled requests as a JSONL batch job and track it in the background"""
+        futures = {custom_id: future for custom_id, _, future in items}
+        try:
+            jsonl = b"\n".join(
+                orjson.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": params
+                })
+                for custom_id, params, _ in items
+            )
+            batch_file = await self.client.files.create(file=("batch.jsonl", jsonl), purpose="batch")
+            batch = await self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+        except Exception as e:
+            logger.error(f"Failed to submit OpenAI batch of {len(items)} requests: {e}")
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        logger.info(f"Submitted OpenAI batch {batch.id} with {len(items)} requests")
+        task = asyncio.create_task(self._await_batch(batch.id, futures))
+        self._batch_jobs[batch.id] = task
+        task.add_done_callback(lambda _: self._batch_jobs.pop(batch.id, None))
+    
+    async def _await_batch(self, batch_id: str, futures: Dict[str, asyncio.Future]):
+        """Poll a batch job until it finishes, then resolve each request's future"""
+        try:
+            while True:
+                batch = await self.client.batches.retrieve(batch_id)
+                if batch.status in BATCH_TERMINAL_STATES:
+                    break
+                await asyncio.sleep(BATCH_POLL_INTERVAL)
+            
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = await self.client.files.content(file_id)
+                    self._resolve_batch_results(content.content, futures)
+            
+            error = Exception(f"OpenAI batch {batch_id} ended with status {batch.status}")
+        except asyncio.CancelledError:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Stopped waiting for OpenAI batch {batch_id}"))
+            raise
+        except Exception as e:
+            logger.error(f"Error waiting for OpenAI batch {batch_id}: {e}")
+            error = e
+        
+        # Anything the output files didn't cover
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(error)
+    
+    def _resolve_batch_results(self, jsonl: bytes, futures: Dict[str, asyncio.Future]):
+        """Settle futures from a batch output or error file"""
+        for line in jsonl.splitlines():
+            if not line.strip():
+                continue
+            result = orjson.loads(line)
+            future = futures.get(result.get("custom_id"))
+            if future is None or future.done():
+                continue
+            
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                error = result.get("error") or response.get("body")
+                future.set_exception(Exception(f"OpenAI batch request failed: {error}"))
+            else:
+                future.set_result(response.get("body") or {})
+    
     async def generate_stream(self, model_id: str, request: AIRequest) -> AsyncGenerator[StreamChunk, None]:
         """Generate streaming response using OpenAI model"""
         if not self.client:
@@ -199,51 +448,66 @@ class OpenAIProvider:
             raise ValueError(f"Model {model_id} not available")
         
         try:
-            # Prepare messages
-            messages = [{"role": "user", "content": request.prompt}]
-            
-            # Add context if provided
-            if request.context:
-                system_message = self._build_system_message(request.context)
-                if system_message:
-                    messages.insert(0, {"role": "system", "content": system_message})
-            
             # Prepare parameters
-            params = {
-                "model": model_id,
-                "messages": messages,
-                "max_tokens": request.max_tokens or 1000,
-                "temperature": request.temperature or 0.7,
-                "top_p": request.top_p or 1.0,
-                "stream": True
-            }
+            params = self._build_params(model_id, request, stream=True)
             
             # Stream response
             chunk_id = 0
-            total_content = ""
+            usage = None
+            
+            prompt_tokens = self._estimate_request_tokens(model_id, params["messages"], 0)
+            reserved = prompt_tokens + params["max_tokens"]
+            self._check_context_window(model_id, reserved)
+            
+            # Read ahead at most STREAM_BUFFER_CHUNKS; a slow consumer stalls the upstream read
+            queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+            start_time = time.perf_counter()
+            producer = asyncio.create_task(self._pump_stream(params, reserved, queue))
+            try:
+                while True:
+                    chunk = await queue.get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if delta.content:
+                            content = delta.content
+                            
+                            stream_chunk = StreamChunk(
+                                chunk_id=chunk_id,
+                                content=content,
+                                is_final=False
+                            )
+                            yield stream_chunk
+                            chunk_id += 1
+            finally:
+                # Consumer gone or failed: stop reading, close the upstream response, free the slot
+                if not producer.done():
+                    producer.cancel()
             
-            async for chunk in await self.client.chat.completions.create(**params):
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if delta.content:
-                        content = delta.content
-                        total_content += content
-                        
-                        stream_chunk = StreamChunk(
-                            chunk_id=chunk_id,
-                            content=content,
-                            is_final=False
-                        )
-                        yield stream_chunk
-                        chunk_id += 1
+            # Without a usage chunk, fall back to our prompt count and one token per content delta
+            if usage:
+                prompt_tokens = usage.prompt_tokens
+                completion_tokens = usage.completion_tokens
+            else:
+                completion_tokens = chunk_id
+            self._settle_tokens(reserved, prompt_tokens + completion_tokens)
             
             # Send final chunk with metadata
             final_chunk = StreamChunk(
                 chunk_id=chunk_id,
                 content="",
                 is_final=True,
-                total_tokens=len(total_content.split()),  # Approximate
-                model_used=model_id
+                total_tokens=completion_tokens,
+                input_tokens=prompt_tokens,
+                output_tokens=completion_tokens,
+                model_used=model_id,
+                processing_time_ms=(time.perf_counter() - start_time) * 1000
             )
             yield final_chunk
             
@@ -251,29 +515,70 @@ class OpenAIProvider:
             logger.error(f"Error streaming with OpenAI model {model_id}: {e}")
             raise
     
+    async def _pump_stream(self, params: Dict[str, Any], reserved: int, queue: asyncio.Queue):
+        """Feed an OpenAI completion stream into a bounded queue, ending with None or the error"""
+        try:
+            async with self._admit():
+                await self._throttle(reserved)
+                raw = await self.client.chat.completions.with_raw_response.create(**params)
+                await self._note_rate_limits(raw.headers)
+                
+                stream = raw.parse()
+                try:
+                    async for chunk in stream:
+                        await queue.put(chunk)
+                finally:
+                    await stream.close()
+            
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+    
     async def check_health(self, model_id: str) -> bool:
         """Check if model is healthy and available"""
         if not self.client:
             return False
         
+        now = time.monotonic()
+        cached = self._health_cache.get(model_id)
+        if cached and cached[1] and now - cached[0] < HEALTH_CACHE_TTL:
+            return True
+        
         try:
-            # Try a simple completion to test the model
-            test_params = {
-                "model": model_id,
-                "messages": [{"role": "user", "content": "Hello"}],
-                "max_tokens": 5
-            }
+            # Model lookup is free; a billable completion only runs every HEALTH_COMPLETION_INTERVAL
+            await self._probe_client.models.retrieve(model_id)
             
-            await self.client.chat.completions.create(**test_params)
-            return True
+            if now - self._completion_probe_at.get(model_id, 0.0) >= HEALTH_COMPLETION_INTERVAL:
+                test_params = {
+                    "model": model_id,
+                    "messages": [{"role": "user", "content": "Hello"}],
+                    "max_tokens": 5
+                }
+                
+                await self._probe_client.chat.completions.create(**test_params)
+                self._completion_probe_at[model_id] = now
+            
+            healthy = True
             
         except Exception as e:
             logger.warning(f"Health check failed for OpenAI model {model_id}: {e}")
-            return False
+            healthy = False
+        
+        self._health_cache[model_id] = (time.monotonic(), healthy)
+        return healthy
+    
+    async def check_health_bulk(self, model_ids: List[str]) -> Dict[str, bool]:
+        """Check several models at once; probes run concurrently"""
+        results = await asyncio.gather(
+            *(self.check_health(model_id) for model_id in model_ids),
+            return_exceptions=True
+        )
+        return {model_id: result is True for model_id, result in zip(model_ids, results)}
     
     async def configure_model(self, model_id: str, config: Dict[str, Any]) -> Dict[str, Any]:
         """Configure model-specific settings"""
-        if model_id not in self.available_models:
+        model_config = self.available_models.get(model_id)
+        if model_config is None:
             raise ValueError(f"Model {model_id} not found")
         
         # OpenAI models don't have much runtime configuration
@@ -282,28 +587,115 @@ class OpenAIProvider:
         result = {"model_id": model_id, "updated_settings": {}}
         
         # Update local configuration
-        model_config = self.available_models[model_id]
-        
         if "is_active" in config:
             model_config.is_active = config["is_active"]
             result["updated_settings"]["is_active"] = config["is_active"]
         
         return result
     
+    def _estimate_request_tokens(self, model_id: str, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Tokens a completion may consume: prompt tokens plus the completion budget"""
+        return sum(count_tokens(m["content"], model_id) for m in messages) + max_tokens
+    
+    def _check_context_window(self, model_id: str, tokens: int):
+        """Reject locally a request the API would refuse for exceeding the context window"""
+        window = _MODEL_CONFIGS[model_id]["context_window"]
+        if tokens > window:
+            raise ValueError(
+                f"Request needs ~{tokens} tokens (prompt + max_tokens), "
+                f"model {model_id} context window is {window}"
+            )
+    
+    @contextlib.asynccontextmanager
+    async def _admit(self):
+        """Hold one of the _cmax in-flight call slots"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self._cmax)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify(1)
+    
+    async def _throttle(self, tokens: int):
+        """Wait until the request and token windows both admit a call, then reserve it"""
+        while True:
+            now = time.monotonic()
+            cutoff = now - RATE_WINDOW
+            while self._req_times and self._req_times[0] <= cutoff:
+                self._req_times.popleft()
+            while self._tok_times and self._tok_times[0][0] <= cutoff:
+                self._tok_sum -= self._tok_times.popleft()[1]
+            
+            wait = self._blocked_until - now
+            if wait <= 0:
+                if len(self._req_times) >= RPM_LIMIT:
+                    wait = self._req_times[0] - cutoff
+                elif self._tok_times and self._tok_sum + tokens > TPM_LIMIT:
+                    wait = self._tok_times[0][0] - cutoff
+                else:
+                    self._req_times.append(now)
+                    self._tok_times.append((now, tokens))
+                    self._tok_sum += tokens
+                    return
+            
+            await asyncio.sleep(wait)
+    
+    def _settle_tokens(self, reserved: int, used: int):
+        """Replace a token reservation with what the call actually used"""
+        if used != reserved:
+            self._tok_times.append((time.monotonic(), used - reserved))
+            self._tok_sum += used - reserved
+    
+    async def _note_rate_limits(self, headers: httpx.Headers):
+        """Track OpenAI's remaining quota: size the in-flight cap to it and pause when exhausted"""
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = _parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+                self._blocked_until = max(self._blocked_until, time.monotonic() + reset)
+        
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining and remaining.isdigit():
+            cmax = max(1, min(MAX_CONCURRENT, int(remaining)))
+            if cmax != self._cmax:
+                async with self._cond:
+                    grew = cmax > self._cmax
+                    self._cmax = cmax
+                    if grew:
+                        self._cond.notify_all()
+    
+    async def close(self):
+        """Stop batching; queued and submitted batch requests are failed, not submitted"""
+        # Submitting now would start a billable job whose results nobody reads
+        for _, _, future in await self._batcher.discard():
+            if not future.done():
+                future.set_exception(RuntimeError("Provider closed before the batch was submitted"))
+        
+        for task in list(self._batch_jobs.values()):
+            task.cancel()
+        if self._batch_jobs:
+            await asyncio.gather(*self._batch_jobs.values(), return_exceptions=True)
+    
     async def get_status(self) -> Dict[str, Any]:
         """Get provider status"""
         if not self.client:
             return {"status": "not_initialized"}
         
         try:
-            # Test API connectivity
-            models = await self.client.models.list()
+            # Test API connectivity with a single-model lookup, at most once per STATUS_CACHE_TTL
+            if time.monotonic() - self._last_healthy_ts >= STATUS_CACHE_TTL:
+                await self._status_client.models.retrieve(STATUS_PROBE_MODEL)
+                self._last_healthy_ts = time.monotonic()
+                self._last_check = datetime.now(timezone.utc).isoformat()
             
             return {
                 "status": "healthy",
                 "models_available": len(self.available_models),
                 "api_accessible": True,
-                "last_check": datetime.utcnow().isoformat()
+                "batches_in_flight": len(self._batch_jobs),
+                "last_check": self._last_check
             }
             
         except Exception as e:
@@ -312,27 +704,43 @@ class OpenAIProvider:
                 "error": str(e),
                 "models_available": len(self.available_models),
                 "api_accessible": False,
-                "last_check": datetime.utcnow().isoformat()
+                "last_check": datetime.now(timezone.utc).isoformat()
             }
     
-    def _build_system_message(self, context: Dict[str, Any]) -> Optional[str]:
-        """Build system message from context"""
-        system_parts = []
-        
-        if context.get("lead_id"):
-            system_parts.append("You are an AI assistant helping with CRM lead management.")
-        
-        if context.get("language"):
-            system_parts.append(f"Respond in {context['language']} language.")
-        
-        if context.get("message_type"):
-            message_type = context["message_type"]
-            if message_type == "whatsapp":
-                system_parts.append("Keep responses concise and suitable for WhatsApp messaging.")
-            elif message_type == "email":
-                system_parts.append("Format response as professional email content.")
+    def _build_params(self, model_id: str, request: AIRequest, stream: bool) -> Dict[str, Any]:
+        """Chat completion parameters for a request"""
+        params = {
+            "model": model_id,
+            "messages": self._build_messages(request),
+            "max_tokens": request.max_tokens or 1000,
+            "temperature": request.temperature if request.temperature is not None else 0.7,
+            "top_p": request.top_p if request.top_p is not None else 1.0,
+        }
+        if stream:
+            params["stream"] = True
+            # Exact token counts arrive on a final chunk with no choices
+            params["stream_options"] = {"include_usage": True}
+        return params
+    
+    def _build_messages(self, request: AIRequest) -> List[Dict[str, str]]:
+        """Chat messages for a request, with a system message built from its context"""
+        messages = []
         
-        if context.get("tone"):
-            system_parts.append(f"Use a {context['tone']} tone in your response.")
+        # Add context if provided
+        if request.context and (system_message := self._build_system_message(request.context)):
+            messages.append({"role": "system", "content": system_message})
         
-        return " ".join(system_parts) if system_parts else None
\ No newline at end of file
+        messages.append({"role": "user", "content": request.prompt})
+        return messages
+    
+    def _build_system_message(self, context: Dict[str, Any]) -> Optional[str]:
+        """Build system message from context"""
+        language = context.get("language")
+        message_type = context.get("message_type")
+        tone = context.get("tone")
+        return _system_message(
+            bool(context.get("lead_id")),
+            str(language) if language else None,
+            message_type if isinstance(message_type, str) else None,
+            str(tone) if tone else None,
+        )
@@ -4,24 +4,85 @@ Token Tracker - Tracks token usage and calculates pricing
 
 import asyncio
 import logging
+import os
 from typing import Dict, List, Optional, Any
 from datetime import datetime, timedelta
-import json
 
 from schemas.ai_schemas import TokenUsage, ModelStats, UsageReport
 from database.db_manager import DatabaseManager
+from utils.batch_writer import BatchWriter
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Usage queue drained in batches; rows beyond USAGE_QUEUE_SIZE are dropped, not awaited
+USAGE_QUEUE_SIZE = int(os.getenv("AI_USAGE_QUEUE_SIZE", "10000"))
+USAGE_BATCH_SIZE = int(os.getenv("AI_USAGE_BATCH_SIZE", "128"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("AI_USAGE_FLUSH_MS", "100")) / 1000
+
+# Reports are invalidated when this worker writes usage; the TTL only bounds
+# staleness from usage written by other workers
+USAGE_CACHE_SIZE = 4096
+USAGE_CACHE_TTL = float(os.getenv("AI_USAGE_CACHE_TTL", "3600"))
+
 class TokenTracker:
     """Tracks token usage and calculates pricing across all models"""
     
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
-        self.usage_cache: Dict[str, Any] = {}
-        self.cache_ttl = 300  # 5 minutes cache TTL
+        self.cache_ttl = USAGE_CACHE_TTL
+        self.usage_cache = TTLCache(maxsize=USAGE_CACHE_SIZE, ttl=self.cache_ttl)
+        # Report cache keys embed these generations; writes bump them so stale
+        # reports are never hit again and simply age out of usage_cache
+        self._user_generations: Dict[str, int] = {}
+        self._global_generation = 0
+        self._usage_writer = BatchWriter(
+            "usage_queue",
+            self.track_usage_bulk,
+            batch_size=USAGE_BATCH_SIZE,
+            flush_interval=USAGE_FLUSH_INTERVAL,
+            maxsize=USAGE_QUEUE_SIZE
+        )
+    
+    def start(self):
+        """Start draining queued usage records"""
+        self._usage_writer.start()
+    
+    async def close(self):
+        """Stop the drain task and write out queued usage records"""
+        await self._usage_writer.stop()
+    
+    def enqueue_usage(
+        self,
+        model_id: str,
+        token_usage: TokenUsage,
+        user_id: str,
+        request_id: Optional[str] = None,
+        context: Optional[Dict[str, Any]] = None
+    ):
+        """Queue token usage for tracking without blocking the caller"""
+        try:
+            self._usage_writer.put(
+                self._usage_row(model_id, token_usage, user_id, request_id, context)
+            )
+        except asyncio.QueueFull:
+            logger.warning(f"Usage queue full, dropped usage record for {model_id}")
+    
+    async def track_usage_bulk(self, rows: List[Dict[str, Any]]):
+        """Write a batch of usage rows with a single COPY"""
+        if not rows:
+            return
+        
+        await self.db.insert_usage_records_bulk(rows)
+        
+        # Invalidate reports that include the new rows
+        for user_id in {row["user_id"] for row in rows}:
+            self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+        self._global_generation += 1
         
+        logger.debug("Tracked usage for %d requests", len(rows))
+    
     async def track_usage(
         self, 
         model_id: str, 
@@ -32,31 +93,39 @@ class TokenTracker:
     ):
         """Track token usage for a request"""
         try:
-            usage_data = {
-                "model_id": model_id,
-                "user_id": user_id,
-                "request_id": request_id,
-                "input_tokens": token_usage.input_tokens,
-                "output_tokens": token_usage.output_tokens,
-                "total_tokens": token_usage.total_tokens,
-                "estimated_cost": token_usage.estimated_cost,
-                "currency": token_usage.currency,
-                "timestamp": datetime.utcnow(),
-                "context": json.dumps(context) if context else None
-            }
-            
-            await self.db.insert_usage_record(usage_data)
+            if self._usage_writer.running:
+                self.enqueue_usage(model_id, token_usage, user_id, request_id, context)
+                return
             
-            # Update cache
-            cache_key = f"usage:{user_id}:{datetime.utcnow().date()}"
-            if cache_key in self.usage_cache:
-                del self.usage_cache[cache_key]  # Invalidate cache
-            
-            logger.debug(f"Tracked usage: {token_usage.total_tokens} tokens for {model_id}")
+            await self.track_usage_bulk(
+                [self._usage_row(model_id, token_usage, user_id, request_id, context)]
+            )
             
         except Exception as e:
             logger.error(f"Error tracking usage: {e}")
     
+    def _usage_row(
+        self,
+        model_id: str,
+        token_usage: TokenUsage,
+        user_id: str,
+        request_id: Optional[str],
+        context: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Build a token_usage row, timestamped when the request finished"""
+        return {
+            "model_id": model_id,
+            "user_id": user_id,
+            "request_id": request_id,
+            "input_tokens": token_usage.input_tokens,
+            "output_tokens": token_usage.output_tokens,
+            "total_tokens": token_usage.total_tokens,
+            "estimated_cost": token_usage.estimated_cost,
+            "currency": token_usage.currency,
+            "timestamp": datetime.utcnow(),
+            "context": context or None
+        }
+    
     async def get_user_usage(
         self, 
         user_id: str, 
@@ -68,93 +137,37 @@ class TokenTracker:
             start_date = end_date - timedelta(days=days)
             
             # Check cache
-            cache_key = f"user_usage:{user_id}:{days}:{start_date.date()}"
-            if cache_key in self.usage_cache:
-                cache_entry = self.usage_cache[cache_key]
-                if (datetime.utcnow() - cache_entry["timestamp"]).seconds < self.cache_ttl:
-                    return cache_entry["data"]
-            
-            # Query database
-            usage_records = await self.db.get_user_usage(user_id, start_date, end_date)
-            
-            # Calculate statistics
-            total_requests = len(usage_records)
-            total_cost = sum(record.get("estimated_cost", 0) for record in usage_records)
-            
-            # Group by model
-            model_stats = {}
-            for record in usage_records:
-                model_id = record["model_id"]
-                if model_id not in model_stats:
-                    model_stats[model_id] = {
-                        "model_id": model_id,
-                        "name": await self._get_model_name(model_id),
-                        "total_requests": 0,
-                        "successful_requests": 0,
-                        "failed_requests": 0,
-                        "total_input_tokens": 0,
-                        "total_output_tokens": 0,
-                        "total_tokens": 0,
-                        "total_cost": 0.0,
-                        "currency": record.get("currency", "USD")
-                    }
-                
-                stats = model_stats[model_id]
-                stats["total_requests"] += 1
-                stats["successful_requests"] += 1  # Assume successful if recorded
-                stats["total_input_tokens"] += record.get("input_tokens", 0)
-                stats["total_output_tokens"] += record.get("output_tokens", 0)
-                stats["total_tokens"] += record.get("total_tokens", 0)
-                stats["total_cost"] += record.get("estimated_cost", 0)
-            
-            # Calculate derived metrics
-            for stats in model_stats.values():
-                if stats["total_requests"] > 0:
-                    stats["success_rate"] = (stats["successful_requests"] / stats["total_requests"]) * 100
-                    stats["average_cost_per_request"] = stats["total_cost"] / stats["total_requests"]
-                else:
-                    stats["success_rate"] = 0
-                    stats["average_cost_per_request"] = 0
-                
-                # Add period info
-                stats["period_start"] = start_date
-                stats["period_end"] = end_date
+            generation = self._user_generations.get(user_id, 0)
+            cache_key = f"user_usage:{user_id}:{generation}:{days}:{start_date.date()}"
+            cached = self.usage_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            # Aggregate in the database; only per-model and per-day rows come back
+            model_rows, day_rows = await asyncio.gather(
+                self.db.get_user_usage_by_model(user_id, start_date, end_date),
+                self.db.get_user_usage_by_day(user_id, start_date, end_date)
+            )
             
-            # Group by day for daily breakdown
-            daily_usage = {}
-            for record in usage_records:
-                day = record["timestamp"].date()
-                if day not in daily_usage:
-                    daily_usage[day] = {
-                        "date": day.isoformat(),
-                        "requests": 0,
-                        "total_tokens": 0,
-                        "cost": 0.0
-                    }
-                
-                daily_usage[day]["requests"] += 1
-                daily_usage[day]["total_tokens"] += record.get("total_tokens", 0)
-                daily_usage[day]["cost"] += record.get("estimated_cost", 0)
+            model_usage = [
+                await self._model_stats_from_row(row, start_date, end_date)
+                for row in model_rows
+            ]
             
             # Create usage report
             report = UsageReport(
                 user_id=user_id,
                 period_start=start_date,
                 period_end=end_date,
-                total_requests=total_requests,
-                total_cost=total_cost,
+                total_requests=sum(stats.total_requests for stats in model_usage),
+                total_cost=sum(stats.total_cost for stats in model_usage),
                 currency="USD",
-                model_usage=[
-                    ModelStats(**stats) for stats in model_stats.values()
-                ],
-                daily_usage=list(daily_usage.values())
+                model_usage=model_usage,
+                daily_usage=[self._daily_entry(row) for row in day_rows]
             )
             
             # Cache result
-            self.usage_cache[cache_key] = {
-                "data": report,
-                "timestamp": datetime.utcnow()
-            }
+            self.usage_cache.set(cache_key, report)
             
             return report
             
@@ -169,120 +182,51 @@ class TokenTracker:
             start_date = end_date - timedelta(days=days)
             
             # Check cache
-            cache_key = f"total_usage:{days}:{start_date.date()}"
-            if cache_key in self.usage_cache:
-                cache_entry = self.usage_cache[cache_key]
-                if (datetime.utcnow() - cache_entry["timestamp"]).seconds < self.cache_ttl:
-                    return cache_entry["data"]
-            
-            # Query database for all users
-            usage_records = await self.db.get_total_usage(start_date, end_date)
-            
-            # Calculate statistics
-            total_requests = len(usage_records)
-            total_cost = sum(record.get("estimated_cost", 0) for record in usage_records)
-            
-            # Group by model
-            model_stats = {}
-            user_stats = {}
-            
-            for record in usage_records:
-                model_id = record["model_id"]
-                user_id = record["user_id"]
-                
-                # Model statistics
-                if model_id not in model_stats:
-                    model_stats[model_id] = {
-                        "model_id": model_id,
-                        "name": await self._get_model_name(model_id),
-                        "total_requests": 0,
-                        "successful_requests": 0,
-                        "failed_requests": 0,
-                        "total_input_tokens": 0,
-                        "total_output_tokens": 0,
-                        "total_tokens": 0,
-                        "total_cost": 0.0,
-                        "currency": record.get("currency", "USD"),
-                        "period_start": start_date,
-                        "period_end": end_date
-                    }
-                
-                stats = model_stats[model_id]
-                stats["total_requests"] += 1
-                stats["successful_requests"] += 1
-                stats["total_input_tokens"] += record.get("input_tokens", 0)
-                stats["total_output_tokens"] += record.get("output_tokens", 0)
-                stats["total_tokens"] += record.get("total_tokens", 0)
-                stats["total_cost"] += record.get("estimated_cost", 0)
-                
-                # User statistics
-                if user_id not in user_stats:
-                    user_stats[user_id] = {
-                        "user_id": user_id,
-                        "requests": 0,
-                        "tokens": 0,
-                        "cost": 0.0
-                    }
-                
-                user_stats[user_id]["requests"] += 1
-                user_stats[user_id]["tokens"] += record.get("total_tokens", 0)
-                user_stats[user_id]["cost"] += record.get("estimated_cost", 0)
-            
-            # Calculate derived metrics
-            for stats in model_stats.values():
-                if stats["total_requests"] > 0:
-                    stats["success_rate"] = (stats["successful_requests"] / stats["total_requests"]) * 100
-                    stats["average_cost_per_request"] = stats["total_cost"] / stats["total_requests"]
-                else:
-                    stats["success_rate"] = 0
-                    stats["average_cost_per_request"] = 0
+            cache_key = f"total_usage:{self._global_generation}:{days}:{start_date.date()}"
+            cached = self.usage_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            # Aggregate in the database; only per-model, per-day and top-user rows come back
+            model_rows, day_rows, user_rows = await asyncio.gather(
+                self.db.get_total_usage_by_model(start_date, end_date),
+                self.db.get_total_usage_by_day(start_date, end_date),
+                self.db.get_top_users(start_date, end_date, limit=10)
+            )
             
-            # Get top users
-            top_users = sorted(
-                user_stats.values(),
-                key=lambda x: x["cost"],
-                reverse=True
-            )[:10]
+            model_usage = [
+                await self._model_stats_from_row(row, start_date, end_date)
+                for row in model_rows
+            ]
+            
+            top_users = [
+                {
+                    "user_id": row["user_id"],
+                    "requests": row["requests"],
+                    "tokens": row["tokens"],
+                    "cost": float(row["cost"])
+                }
+                for row in user_rows
+            ]
             
-            # Group by day for daily breakdown
-            daily_usage = {}
-            for record in usage_records:
-                day = record["timestamp"].date()
-                if day not in daily_usage:
-                    daily_usage[day] = {
-                        "date": day.isoformat(),
-                        "requests": 0,
-                        "total_tokens": 0,
-                        "cost": 0.0
-                    }
-                
-                daily_usage[day]["requests"] += 1
-                daily_usage[day]["total_tokens"] += record.get("total_tokens", 0)
-                daily_usage[day]["cost"] += record.get("estimated_cost", 0)
+            # Add top users to model stats
+            for model_stat in model_usage:
+                model_stat.top_users = top_users
             
             # Create usage report
             report = UsageReport(
                 user_id=None,  # System-wide report
                 period_start=start_date,
                 period_end=end_date,
-                total_requests=total_requests,
-                total_cost=total_cost,
+                total_requests=sum(stats.total_requests for stats in model_usage),
+                total_cost=sum(stats.total_cost for stats in model_usage),
                 currency="USD",
-                model_usage=[
-                    ModelStats(**stats) for stats in model_stats.values()
-                ],
-                daily_usage=list(daily_usage.values())
+                model_usage=model_usage,
+                daily_usage=[self._daily_entry(row) for row in day_rows]
             )
             
-            # Add top users to model stats
-            for model_stat in report.model_usage:
-                model_stat.top_users = top_users
-            
             # Cache result
-            self.usage_cache[cache_key] = {
-                "data": report,
-                "timestamp": datetime.utcnow()
-            }
+            self.usage_cache.set(cache_key, report)
             
             return report
             
@@ -296,35 +240,28 @@ class TokenTracker:
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
             
-            usage_records = await self.db.get_model_usage(model_id, start_date, end_date)
+            totals, user_rows = await asyncio.gather(
+                self.db.get_model_usage_totals(model_id, start_date, end_date),
+                self.db.get_model_top_users(model_id, start_date, end_date, limit=5)
+            )
             
             # Calculate statistics
-            total_requests = len(usage_records)
+            total_requests = totals["requests"]
             successful_requests = total_requests  # Assume all recorded requests are successful
-            total_input_tokens = sum(record.get("input_tokens", 0) for record in usage_records)
-            total_output_tokens = sum(record.get("output_tokens", 0) for record in usage_records)
-            total_tokens = sum(record.get("total_tokens", 0) for record in usage_records)
-            total_cost = sum(record.get("estimated_cost", 0) for record in usage_records)
+            total_input_tokens = totals["input_tokens"]
+            total_output_tokens = totals["output_tokens"]
+            total_tokens = totals["total_tokens"]
+            total_cost = float(totals["estimated_cost"])
             
             # Calculate derived metrics
             success_rate = (successful_requests / total_requests * 100) if total_requests > 0 else 0
             average_cost_per_request = total_cost / total_requests if total_requests > 0 else 0
             
             # Get top users for this model
-            user_stats = {}
-            for record in usage_records:
-                user_id = record["user_id"]
-                if user_id not in user_stats:
-                    user_stats[user_id] = {"user_id": user_id, "requests": 0, "cost": 0.0}
-                
-                user_stats[user_id]["requests"] += 1
-                user_stats[user_id]["cost"] += record.get("estimated_cost", 0)
-            
-            top_users = sorted(
-                user_stats.values(),
-                key=lambda x: x["cost"],
-                reverse=True
-            )[:5]
+            top_users = [
+                {"user_id": row["user_id"], "requests": row["requests"], "cost": float(row["cost"])}
+                for row in user_rows
+            ]
             
             return ModelStats(
                 model_id=model_id,
@@ -399,14 +336,14 @@ class TokenTracker:
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(hours=24)
             
-            recent_usage = await self.db.get_total_usage(start_date, end_date)
+            recent_usage = await self.db.get_total_usage_by_model(start_date, end_date)
             
             return {
                 "status": "healthy",
                 "cache_entries": len(self.usage_cache),
                 "cache_ttl_seconds": self.cache_ttl,
-                "recent_24h_requests": len(recent_usage),
-                "recent_24h_cost": sum(r.get("estimated_cost", 0) for r in recent_usage),
+                "recent_24h_requests": sum(r["requests"] for r in recent_usage),
+                "recent_24h_cost": sum(r["estimated_cost"] for r in recent_usage),
                 "database_connected": await self.db.is_connected(),
                 "last_check": datetime.utcnow().isoformat()
             }
@@ -418,6 +355,42 @@ class TokenTracker:
                 "last_check": datetime.utcnow().isoformat()
             }
     
+    async def _model_stats_from_row(
+        self,
+        row: Dict[str, Any],
+        start_date: datetime,
+        end_date: datetime
+    ) -> ModelStats:
+        """Build ModelStats from a per-model aggregate row"""
+        total_requests = row["requests"]
+        total_cost = float(row["estimated_cost"])
+        
+        return ModelStats(
+            model_id=row["model_id"],
+            name=await self._get_model_name(row["model_id"]),
+            total_requests=total_requests,
+            successful_requests=total_requests,  # Assume successful if recorded
+            failed_requests=0,
+            success_rate=100.0 if total_requests > 0 else 0,
+            total_input_tokens=row["input_tokens"],
+            total_output_tokens=row["output_tokens"],
+            total_tokens=row["total_tokens"],
+            total_cost=total_cost,
+            average_cost_per_request=total_cost / total_requests if total_requests > 0 else 0,
+            currency=row["currency"] or "USD",
+            period_start=start_date,
+            period_end=end_date
+        )
+    
+    def _daily_entry(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a daily_usage entry from a per-day aggregate row"""
+        return {
+            "date": row["day"].isoformat(),
+            "requests": row["requests"],
+            "total_tokens": row["total_tokens"],
+            "cost": float(row["estimated_cost"])
+        }
+    
     async def _get_model_name(self, model_id: str) -> str:
         """Get human-readable model name"""
         # This would typically query the model manager or database
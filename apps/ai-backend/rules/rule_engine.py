@@ -11,17 +11,23 @@ from datetime import datetime
 
 from schemas.ai_schemas import AIRequest, AIResponse, CustomRule, RuleSet, RuleType
 from database.db_manager import DatabaseManager
+from utils.cache import TTLCache
 from utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+RULE_CACHE_SIZE = 1024
+
 class RuleEngine:
     """Processes custom rules for AI requests and responses"""
     
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
-        self.rule_cache: Dict[str, RuleSet] = {}
-        self.cache_ttl = 300  # 5 minutes cache TTL
+        self.cache_ttl = 60  # Bounds staleness only if change notifications are unavailable
+        self.rule_cache = TTLCache(maxsize=RULE_CACHE_SIZE, ttl=self.cache_ttl)
+        
+        # Drop rule sets changed by any worker as soon as the database announces it
+        self.db.on_rule_set_changed(self.rule_cache.pop)
         
     async def create_rule_set(self, rule_set: RuleSet) -> RuleSet:
         """Create a new rule set"""
@@ -46,7 +52,7 @@ class RuleEngine:
             await self.db.insert_rule_set(rule_set_data)
             
             # Cache the rule set
-            self.rule_cache[rule_set.rule_set_id] = rule_set
+            self.rule_cache.set(rule_set.rule_set_id, rule_set)
             
             logger.info(f"Created rule set: {rule_set.rule_set_id}")
             return rule_set
@@ -59,8 +65,9 @@ class RuleEngine:
         """Get a rule set by ID"""
         try:
             # Check cache first
-            if rule_set_id in self.rule_cache:
-                return self.rule_cache[rule_set_id]
+            rule_set = self.rule_cache.get(rule_set_id)
+            if rule_set is not None:
+                return rule_set
             
             # Query database
             rule_set_data = await self.db.get_rule_set(rule_set_id)
@@ -71,7 +78,7 @@ class RuleEngine:
             rule_set = self._deserialize_rule_set(rule_set_data)
             
             # Cache result
-            self.rule_cache[rule_set_id] = rule_set
+            self.rule_cache.set(rule_set_id, rule_set)
             
             return rule_set
             
@@ -90,7 +97,7 @@ class RuleEngine:
                 rule_sets.append(rule_set)
                 
                 # Cache the rule set
-                self.rule_cache[rule_set.rule_set_id] = rule_set
+                self.rule_cache.set(rule_set.rule_set_id, rule_set)
             
             return rule_sets
             
@@ -121,8 +128,8 @@ class RuleEngine:
             
             await self.db.update_rule_set(rule_set_id, rule_set_data)
             
-            # Update cache
-            self.rule_cache[rule_set_id] = rule_set
+            # Invalidate so the next read picks up the stored row
+            self.rule_cache.pop(rule_set_id)
             
             logger.info(f"Updated rule set: {rule_set_id}")
             return rule_set
@@ -137,8 +144,7 @@ class RuleEngine:
             await self.db.delete_rule_set(rule_set_id)
             
             # Remove from cache
-            if rule_set_id in self.rule_cache:
-                del self.rule_cache[rule_set_id]
+            self.rule_cache.pop(rule_set_id)
             
             logger.info(f"Deleted rule set: {rule_set_id}")
             
@@ -174,7 +180,7 @@ class RuleEngine:
                     if await self._check_rule_condition(rule, request=modified_request):
                         modified_request = await self._apply_input_rule_action(rule, modified_request)
                         rules_applied.append(rule.rule_id)
-                        logger.debug(f"Applied input rule: {rule.rule_id}")
+                        logger.debug("Applied input rule: %s", rule.rule_id)
                         
                 except Exception as e:
                     logger.error(f"Error applying input rule {rule.rule_id}: {e}")
@@ -217,7 +223,7 @@ class RuleEngine:
                     if await self._check_rule_condition(rule, response=modified_response):
                         modified_response = await self._apply_output_rule_action(rule, modified_response)
                         rules_applied.append(rule.rule_id)
-                        logger.debug(f"Applied output rule: {rule.rule_id}")
+                        logger.debug("Applied output rule: %s", rule.rule_id)
                         
                 except Exception as e:
                     logger.error(f"Error applying output rule {rule.rule_id}: {e}")
@@ -469,8 +475,8 @@ class RuleEngine:
             await self.db.track_rule_usage(usage_data)
             
             # Update rule set usage count
-            if rule_set_id in self.rule_cache:
-                rule_set = self.rule_cache[rule_set_id]
+            rule_set = self.rule_cache.get(rule_set_id)
+            if rule_set is not None:
                 rule_set.usage_count += 1
                 rule_set.last_used = datetime.utcnow()
             
@@ -37,6 +37,7 @@ class TokenUsage(BaseModel):
     input_tokens: int = 0
     output_tokens: int = 0
     total_tokens: int = 0
+    cached_tokens: int = 0
     estimated_cost: float = 0.0
     currency: str = "USD"
 
@@ -245,6 +246,8 @@ class StreamChunk(BaseModel):
     
     # Metadata for final chunk
     total_tokens: Optional[int] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
     model_used: Optional[str] = None
     processing_time_ms: Optional[float] = None
 
@@ -0,0 +1,109 @@
+"""
+Batch writer - Buffers rows in memory and writes them in batches
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class BatchWriter:
+    """Collects rows from many callers and hands them to a writer in batches"""
+
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[List[Any]], Awaitable[None]],
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        maxsize: int = 0
+    ):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write = write
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._pending: List[Any] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the background flush task is active"""
+        return self._task is not None
+
+    def start(self):
+        """Start the background flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def put(self, row: Any):
+        """Queue a row for the next batch, raising asyncio.QueueFull when bounded and full"""
+        self._queue.put_nowait(row)
+
+    def qsize(self) -> int:
+        """Number of rows waiting to be written"""
+        return self._queue.qsize() + len(self._pending)
+
+    async def stop(self):
+        """Stop the background task and write out anything still buffered"""
+        await self._cancel()
+        await self.flush()
+
+    async def discard(self) -> List[Any]:
+        """Stop the background task and return anything still buffered, unwritten"""
+        await self._cancel()
+
+        rows = self._pending
+        while not self._queue.empty():
+            rows.append(self._queue.get_nowait())
+        self._pending = []
+        return rows
+
+    async def _cancel(self):
+        """Cancel the background task, if running"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        """Collect rows until the batch is full or the window closes, then write"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            self._pending.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+
+            while len(self._pending) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    self._pending.append(
+                        await asyncio.wait_for(self._queue.get(), remaining)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending and queued rows"""
+        while not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+
+        if not self._pending:
+            return
+
+        try:
+            await self._write(self._pending)
+        except Exception as e:
+            logger.error(f"{self.name}: dropped batch of {len(self._pending)} rows: {e}")
+
+        # Only reset once written so a cancelled flush is retried on stop
+        self._pending = []
@@ -0,0 +1,55 @@
+"""
+Token counting - Tokenizer lookup and memoized per-text token counts
+"""
+
+import functools
+import hashlib
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Encoding used for models tiktoken does not know (local/open-source models)
+DEFAULT_ENCODING = "cl100k_base"
+
+# Number of (text digest, model) counts remembered
+TOKEN_COUNT_CACHE_SIZE = 100_000
+
+_counts: "OrderedDict[Tuple[bytes, str], int]" = OrderedDict()
+
+@functools.lru_cache(maxsize=64)
+def get_tokenizer(model: str) -> Optional[Any]:
+    """Tokenizer for a model, or None when tiktoken is not installed"""
+    if tiktoken is None:
+        return None
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def count_tokens(text: str, model: str) -> int:
+    """Number of tokens in text for a model, computed once per distinct text"""
+    if not text:
+        return 0
+
+    key = (hashlib.blake2b(text.encode(), digest_size=16).digest(), model)
+    count = _counts.get(key)
+    if count is not None:
+        _counts.move_to_end(key)
+        return count
+
+    tokenizer = get_tokenizer(model)
+    if tokenizer is None:
+        # Rough approximation: ~4 characters per token for English
+        count = max(1, len(text) // 4)
+    else:
+        count = len(tokenizer.encode(text, disallowed_special=()))
+
+    _counts[key] = count
+    if len(_counts) > TOKEN_COUNT_CACHE_SIZE:
+        _counts.popitem(last=False)
+    return count